@@ -7,4 +7,14 @@ class User(AbstractUser):
     avatar = models.ImageField(upload_to='users/%Y/%m/%d/', blank=True, null=True)
     about_self = models.CharField(max_length=300, blank=True, null=True)
     email = models.EmailField(_("email address"), unique=True)
-    user_updated = models.DateTimeField(auto_now=True)
\ No newline at end of file
+    user_updated = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_username = instance.__dict__.get('username')
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.loaded_username = self.username
@@ -1,17 +1,27 @@
 from django.contrib.sitemaps import Sitemap
 from django.contrib.auth import get_user_model
+from django.db.models import Max
 from django.urls import reverse
+from django.utils import translation
 
 
 class UserSitemap(Sitemap):
     changefreq = 'never'
     priority = 0.4
+    limit = 5000
+
+    def __init__(self, language=None):
+        self.language = language
 
     def items(self):
-        return get_user_model().objects.all()
+        return get_user_model().objects.only('pk', 'user_updated').order_by('pk')
+
+    def get_latest_lastmod(self):
+        return get_user_model().objects.aggregate(latest=Max('user_updated'))['latest']
     
     def lastmod(self, obj):
         return obj.user_updated
 
     def location(self, obj):
-        return reverse('account:user_detail', args=(obj.pk, ))
\ No newline at end of file
+        with translation.override(self.language):
+            return reverse('account:user_detail', args=(obj.pk, ))
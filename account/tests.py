@@ -1,7 +1,11 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import User
+from blog.models import Article, Comment
+from forum.query_budget import QueryBudgetMixin
+from forum.redis import breaker
+import time
 
 # Перед проведением тестов не забудьте поменять настройки кеширования в settings на dummycache
 
@@ -9,7 +13,7 @@ def user_create(username, password, email=''):
     return get_user_model().objects.create_user(username=username, password=password, email=email)
 
 
-class UserTest(TestCase):
+class UserTest(QueryBudgetMixin, TestCase):
     username = 'Test'
     password = 'alskdjfhg'
 
@@ -161,6 +165,26 @@ class UserTest(TestCase):
         self.assertQuerySetEqual(response.context['articles'], [])
         self.assertQuerySetEqual(response.context['comments'], [])
 
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_user_detail_conditional_get(self):
+        user = user_create(username=self.username, password=self.password)
+        url = reverse('account:user_detail', args=(user.id, ))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Cookie', response['Vary'])
+        self.assertIn('public', response['Cache-Control'])
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        user.about_self = 'Changed'
+        user.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.client.login(username=self.username, password=self.password)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+
     def test_user_edit(self):
         user = user_create(username=self.username, password=self.password)
         url = reverse('account:edit', args=(user.id, ))
@@ -281,4 +305,27 @@ class UserTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTrue(response.context['user'].is_authenticated)
         self.assertTemplateUsed('account/detail.html')
-        self.assertEqual(response.context['user'].username, self.username)
\ No newline at end of file
+        self.assertEqual(response.context['user'].username, self.username)
+
+    def test_user_detail_query_budget(self):
+        user = user_create(self.username, self.password, 'test@example.com')
+        for i in range(3):
+            article = Article.objects.create(author=user, title=f'title {i}', slug=f'title-{i}', body='body', status='PB')
+            article.tags.add('music')
+            Comment.objects.create(author=user, article=article, body='comment')
+        url = reverse('account:user_detail', args=(user.id, ))
+        self.assertWithinBudget(url)
+        self.client.login(username=self.username, password=self.password)
+        self.assertWithinBudget(url)
+
+    def test_token_login_redis_unavailable(self):
+        user_create(self.username, self.password, 'test@example.com')
+        breaker.failures = breaker.threshold
+        breaker.opened_at = time.monotonic()
+        try:
+            response = self.client.post(reverse('account:authentication_token_login'), {'token': 't' * 60})
+        finally:
+            breaker.success()
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['user'].is_authenticated)
+        self.assertTrue(any(message.level_tag == 'error' for message in response.context['messages']))
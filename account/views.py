@@ -10,29 +10,42 @@ from django.utils.translation import gettext_lazy as _
 from .forms import NewEmailForm, RegistrationForm, ConfirmationCodeForm, TokenAuthenticationForm, PasswordConfirmationForm
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.utils.crypto import get_random_string
-from django.conf import settings
 from django.contrib import messages
+from django.db.models import Count, Max
+from forum.conditional import ConditionalGetMixin
+from forum.query_budget import query_budget
+from blog.caching import get_version, version_datetime, ARTICLE_LIST
+from blog.models import Article, Comment
+from forum.redis import r
 from .tasks import confirmation_code_create
 import secrets
 import redis
 import random
 
 
-r = redis.Redis(
-    host=settings.REDIS_HOST,
-    port=settings.REDIS_PORT,
-    db=settings.REDIS_DB,
-)
+TOKENS_UNAVAILABLE = _('Authentication tokens are temporarily unavailable, please try again later')
 
 
-class UserDetailView(DetailView):
+@query_budget(queries=8, redis=0)
+class UserDetailView(ConditionalGetMixin, DetailView):
     model = get_user_model()
     template_name = 'account/detail.html'
     context_object_name = 'user'
 
+    def get_validators(self, request, *args, **kwargs):
+        user = get_user_model().objects.filter(pk=kwargs['pk']).values('user_updated').first()
+        if user is None:
+            return None
+        articles = Article.objects.filter(author_id=kwargs['pk']).aggregate(updated=Max('updated'), total=Count('id'))
+        comments = Comment.objects.filter(author_id=kwargs['pk']).aggregate(updated=Max('updated'), total=Count('id'))
+        last_modified = max(filter(None, (user['user_updated'], articles['updated'], comments['updated'],
+                                          version_datetime(ARTICLE_LIST))))
+        return ((user['user_updated'], articles['updated'], articles['total'],
+                 comments['updated'], comments['total'], get_version(ARTICLE_LIST)), last_modified)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user = self.get_object()
+        user = self.object
         context['articles'] = user.articles.all()
         context['comments'] = user.comments_published.select_related('article').all()
         return context
@@ -200,21 +213,25 @@ class TokenCreateView(FormView):
     success_url = reverse_lazy('account:authentication_token_info')
     
     def form_valid(self, form):
-        is_token_already_exist = r.get(f'user:{self.request.user.id}:authentication_token')
+        try:
+            is_token_already_exist = r.get(f'user:{self.request.user.id}:authentication_token')
 
-        if is_token_already_exist is not None:
-            authentication_token = is_token_already_exist.decode('utf-8')
-            r.delete(f'user:{self.request.user.id}:authentication_token')
-            r.delete(f'auth_token:{authentication_token}:user')
+            if is_token_already_exist is not None:
+                authentication_token = is_token_already_exist.decode('utf-8')
+                r.delete(f'user:{self.request.user.id}:authentication_token')
+                r.delete(f'auth_token:{authentication_token}:user')
 
-        if self.request.user.check_password(form.cleaned_data['password']):
+            if not self.request.user.check_password(form.cleaned_data['password']):
+                return self.form_invalid(form)
             random_quantity = random.randint(50, 70)
             authentication_token = secrets.token_urlsafe(random_quantity)
             r.set(f'user:{self.request.user.id}:authentication_token', authentication_token, 360000)
             r.set(f'auth_token:{authentication_token}:user', self.request.user.username, ex=360000)
-            messages.success(self.request, _('New authentication token has been created'))
-            return super().form_valid(form)
-        return self.form_invalid(form)
+        except redis.RedisError:
+            messages.error(self.request, TOKENS_UNAVAILABLE)
+            return self.render_to_response(self.get_context_data(form=form))
+        messages.success(self.request, _('New authentication token has been created'))
+        return super().form_valid(form)
     
     def form_invalid(self, form):
         messages.error(self.request, _('Password incorrect'))
@@ -226,7 +243,11 @@ class TokenInfoView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        authentication_token = r.get(f'user:{self.request.user.id}:authentication_token').decode('utf-8')
+        try:
+            authentication_token = r.get(f'user:{self.request.user.id}:authentication_token').decode('utf-8')
+        except redis.RedisError:
+            messages.error(self.request, TOKENS_UNAVAILABLE)
+            authentication_token = None
         context['authentication_token'] = authentication_token
         return context
 
@@ -240,7 +261,11 @@ class TokenLoginView(FormView):
     
     def form_valid(self, form):
         entered_token = form.cleaned_data['token']
-        username = r.get(f'auth_token:{entered_token}:user')
+        try:
+            username = r.get(f'auth_token:{entered_token}:user')
+        except redis.RedisError:
+            messages.error(self.request, TOKENS_UNAVAILABLE)
+            return self.form_invalid(form)
         if username is not None:
             username = username.decode('utf-8')
             try:
@@ -0,0 +1,81 @@
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from blog.indexes import TaggedArticlePaginator
+from blog.pagination import InvalidCursor, KeysetPaginator
+
+
+class KeysetCursorPagination(BasePagination):
+    # DRF adapter for blog's KeysetPaginator: opaque cursors over the
+    # ordering columns, so pages cost neither OFFSET nor COUNT
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 20
+    max_page_size = 100
+    ordering = ('-publish', '-id')
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_paginator(self, queryset, view=None):
+        return KeysetPaginator(queryset, self.get_page_size(self.request), self.ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        paginator = self.get_paginator(queryset, view)
+        try:
+            self.page = paginator.page(request.query_params.get(self.cursor_query_param))
+        except InvalidCursor:
+            raise NotFound('Invalid cursor.')
+        return list(self.page)
+
+    def get_paginated_data(self, data):
+        # Cursors rather than links, so the result can be cached for any host
+        return {'next': self.page.next_cursor, 'previous': self.page.previous_cursor, 'results': data}
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_linked_response(self, request, paginated):
+        self.request = request
+        return Response({'next': self.get_link(paginated['next']),
+                         'previous': self.get_link(paginated['previous']),
+                         'results': paginated['results']})
+
+    def get_paginated_response(self, data):
+        return self.get_linked_response(self.request, self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class ArticleCursorPagination(KeysetCursorPagination):
+    # Tag filters page through the tag index, like the web list does
+    def get_paginator(self, queryset, view=None):
+        tag_filter = view.get_tag_filter() if view is not None else None
+        if tag_filter is None:
+            return super().get_paginator(queryset, view)
+        tag_ids, match = tag_filter
+        return TaggedArticlePaginator(queryset, self.get_page_size(self.request), tag_ids, match)
+
+
+class UserCursorPagination(KeysetCursorPagination):
+    ordering = ('id', )
+
+
+class CommentCursorPagination(KeysetCursorPagination):
+    ordering = ('-created', '-id')
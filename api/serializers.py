@@ -17,14 +17,37 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ['name']
 
 
-class ArticleListSerializer(serializers.ModelSerializer):
+class TagCountSerializer(serializers.ModelSerializer):
+    articles = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Tag
+        fields = ['name', 'slug', 'articles']
+
+    def get_articles(self, tag):
+        counter = getattr(tag, 'article_counter', None)
+        return counter.published if counter else 0
+
+
+class SparseFieldsMixin:
+    # Serializes only the given subset of Meta.fields
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class ArticleListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
     author = serializers.ReadOnlyField(source='author.username')
+    # Left out of the article list API unless asked for with ?include=
+    expansions = ('author', 'tags')
     
     class Meta:
         model = Article
         fields = ['id', 'author', 'title', 'publish',
-                  'updated', 'tags']
+                  'updated', 'views', 'comment_count', 'tags']
 
 
 class ArticleSerializer(serializers.ModelSerializer):
@@ -35,14 +58,29 @@ class ArticleSerializer(serializers.ModelSerializer):
     class Meta:
         model = Article
         fields = ['id', 'author', 'title', 'slug', 'body', 'publish',
-                  'updated', 'status', 'comments', 'tags']
+                  'updated', 'status', 'views', 'comment_count', 'comments', 'tags']
+
 
 
+class ArticleBulkItemSerializer(serializers.ModelSerializer):
+    tags = serializers.ListField(child=serializers.CharField(max_length=100), allow_empty=False)
+
+    class Meta:
+        model = Article
+        fields = ['title', 'body', 'status', 'publish', 'tags']
+        extra_kwargs = {'publish': {'required': False}}
+
+
+class UserCommentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Comment
+        fields = ['id', 'article', 'body', 'created']
+
 
 class UserSerializer(serializers.ModelSerializer):
-    comments_published = CommentSerializer(many=True, read_only=True)
+    latest_comments = UserCommentSerializer(many=True, read_only=True)
 
     class Meta:
         model = get_user_model()
         fields = ['id', 'username', 'first_name', 'last_name',
-                  'email', 'date_joined', 'about_self', 'comments_published']
\ No newline at end of file
+                  'date_joined', 'about_self', 'latest_comments']
\ No newline at end of file
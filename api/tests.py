@@ -1,4 +1,5 @@
 from rest_framework.test import APITestCase
+from django.test import override_settings
 from blog.models import Article, Comment
 from django.urls import reverse
 from rest_framework import status
@@ -6,6 +7,9 @@ from django.utils.text import slugify
 from django.contrib.auth import get_user_model
 from unidecode import unidecode
 from django.utils import timezone
+from django.conf import settings
+import redis
+from forum.query_budget import QueryBudgetMixin
 
 # Перед проведением тестов не забудьте поменять настройки кеширования в settings на dummycache
 
@@ -19,8 +23,11 @@ def comment_create(author, body, article):
 def user_create():
     return get_user_model().objects.create_user(username='test', password='qowieuryt')    
 
+def redis_create():
+    return redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB)
 
-class APITests(APITestCase):
+
+class APITests(QueryBudgetMixin, APITestCase):
     title = 'article_test'
     body = 'something...'
     slug = slugify(unidecode(title))
@@ -37,8 +44,8 @@ class APITests(APITestCase):
         url = reverse('api:article_list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
-        self.assertNotIn(self.article_df, response.data)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertNotIn(self.article_df.id, [item['id'] for item in response.data['results']])
 
     def test_article_pb_detail(self):
         self.SetUp()
@@ -177,9 +184,219 @@ class APITests(APITestCase):
         url = reverse('api:user_list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['id'], self.user.id)
-        self.assertEqual(response.data[0]['username'], self.user.username)
-        self.assertEqual(response.data[0]['first_name'], self.user.first_name)
-        self.assertEqual(response.data[0]['last_name'], self.user.last_name)
-        self.assertQuerySetEqual(response.data[0]['comments_published'], self.user.comments_published.all())
\ No newline at end of file
+        self.assertEqual(len(response.data['results']), 1)
+        user = response.data['results'][0]
+        self.assertEqual(user['id'], self.user.id)
+        self.assertEqual(user['username'], self.user.username)
+        self.assertEqual(user['first_name'], self.user.first_name)
+        self.assertEqual(user['last_name'], self.user.last_name)
+        self.assertNotIn('email', user)
+        self.assertEqual(user['latest_comments'], [])
+
+    def test_user_list_latest_comments(self):
+        self.SetUp()
+        other = get_user_model().objects.create_user(username='other', email='other@example.com', password='qowieuryt')
+        comments = [comment_create(self.user, f'comment {i}', self.article_pb1) for i in range(7)]
+        comment_create(other, 'other comment', self.article_pb2)
+        url = reverse('api:user_list')
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        users = {user['id']: user for user in response.data['results']}
+        self.assertEqual([comment['id'] for comment in users[self.user.id]['latest_comments']],
+                         [comment.id for comment in comments[::-1][:5]])
+        self.assertEqual(len(users[other.id]['latest_comments']), 1)
+        response = self.client.get(url, {'page_size': 1})
+        self.assertEqual([user['id'] for user in response.data['results']], [self.user.id])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([user['id'] for user in response.data['results']], [other.id])
+        comments_url = reverse('api:user_comments', args=(self.user.id, ))
+        response = self.client.get(comments_url, {'page_size': 4})
+        self.assertEqual([comment['id'] for comment in response.data['results']], [comment.id for comment in comments[::-1][:4]])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([comment['id'] for comment in response.data['results']], [comment.id for comment in comments[2::-1]])
+        self.assertEqual(response.data['results'][0]['article'], self.article_pb1.id)
+        response = self.client.get(reverse('api:user_comments', args=(other.id + 100, )))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_tag_list(self):
+        self.SetUp()
+        self.article_pb1.tags.add('music')
+        url = reverse('api:tag_list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['articles'], 2)
+        self.assertEqual(response.data['tags'], [{'name': 'music', 'slug': 'music', 'articles': 1}])
+
+    def test_article_bulk_create(self):
+        redis = redis_create()
+        for key in [*redis.scan_iter('article:*:related'), *redis.scan_iter('tag:*:articles')]:
+            redis.delete(key)
+        self.SetUp()
+        self.article_pb1.tags.add('music')
+        url = reverse('api:article_bulk_create')
+        data = [
+            {'title': 'Bulk one', 'body': '**first**', 'status': 'PB', 'tags': ['music', 'rock']},
+            {'title': 'Bulk two', 'body': 'second', 'tags': ['rock']},
+            {'title': '', 'body': 'no title', 'tags': ['rock']},
+            {'title': 'No tags', 'body': 'third', 'tags': []},
+        ]
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(self.user)
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([item['index'] for item in response.data['created']], [0, 1])
+        self.assertEqual(set(response.data['errors']), {2, 3})
+        first = Article.objects.get(id=response.data['created'][0]['id'])
+        self.assertEqual(first.body_html, '<p><strong>first</strong></p>')
+        self.assertEqual(set(first.tags.values_list('name', flat=True)), {'music', 'rock'})
+        second = Article.objects.get(id=response.data['created'][1]['id'])
+        self.assertEqual(second.status, 'DF')
+        response = self.client.get(reverse('api:tag_list'))
+        self.assertEqual(response.data['articles'], 3)
+        self.assertEqual({tag['name']: tag['articles'] for tag in response.data['tags']}, {'music': 2, 'rock': 1})
+        response = self.client.get(reverse('api:article_related', args=(first.id, )))
+        self.assertEqual([item['id'] for item in response.data], [self.article_pb1.id])
+        response = self.client.post(url, data[2:], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_article_bulk_create_drafts_listed(self):
+        self.SetUp()
+        self.client.force_authenticate(self.user)
+        list_url = reverse('api:article_list')
+        self.assertEqual(len(self.client.get(list_url).data['results']), 3)
+        response = self.client.post(reverse('api:article_bulk_create'),
+                                    [{'title': 'Bulk draft', 'body': 'draft', 'tags': ['rock']}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        created = response.data['created'][0]['id']
+        response = self.client.get(list_url)
+        self.assertEqual(len(response.data['results']), 4)
+        self.assertIn(created, [item['id'] for item in response.data['results']])
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_article_conditional_get(self):
+        self.SetUp()
+        url = reverse('api:article_detail', args=(self.article_pb1.id, ))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        list_url = reverse('api:article_list')
+        etag = self.client.get(list_url)['ETag']
+        self.assertEqual(self.client.get(list_url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.client.get(list_url + '?tag=x', HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(list_url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+        etag = self.client.get(list_url)['ETag']
+        self.article_df.title = 'Changed draft'
+        self.article_df.save()
+        self.assertEqual(self.client.get(list_url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_api_response_cache(self):
+        self.SetUp()
+        other = get_user_model().objects.create_user(username='other', email='other@example.com', password='qowieuryt')
+        list_url = reverse('api:article_list')
+        self.assertEqual(len(self.client.get(list_url).data['results']), 2)
+        self.client.force_authenticate(self.user)
+        response = self.client.get(list_url)
+        self.assertEqual({item['id'] for item in response.data['results']},
+                         {self.article_df.id, self.article_pb1.id, self.article_pb2.id})
+        self.client.force_authenticate(other)
+        self.assertEqual(len(self.client.get(list_url).data['results']), 2)
+        self.client.force_authenticate(None)
+        self.assertEqual(len(self.client.get(list_url).data['results']), 2)
+        self.client.force_authenticate(self.user)
+        self.article_df.title = 'Changed draft'
+        self.article_df.save()
+        response = self.client.get(reverse('api:article_detail', args=(self.article_df.id, )))
+        self.assertEqual(response.data['title'], 'Changed draft')
+        self.client.force_authenticate(None)
+        response = self.client.get(reverse('api:article_detail', args=(self.article_df.id, )))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.article_df.status = 'PB'
+        self.article_df.save()
+        self.assertEqual(len(self.client.get(list_url).data['results']), 3)
+        detail_url = reverse('api:article_detail', args=(self.article_pb1.id, ))
+        self.assertEqual(self.client.get(detail_url).data['comments'], [])
+        comment_create(other, 'first!', self.article_pb1)
+        self.assertEqual(len(self.client.get(detail_url).data['comments']), 1)
+        user_url = reverse('api:user_list')
+        self.assertEqual(len(self.client.get(user_url).data['results']), 2)
+        get_user_model().objects.create_user(username='third', email='third@example.com', password='qowieuryt')
+        self.assertEqual(len(self.client.get(user_url).data['results']), 3)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_article_list_author_renamed(self):
+        self.SetUp()
+        url = reverse('api:article_list')
+        response = self.client.get(url, {'include': 'author'})
+        self.assertEqual(response.data['results'][0]['author'], 'test')
+        user = get_user_model().objects.get(id=self.user.id)
+        user.save()
+        response = self.client.get(url, {'include': 'author'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        user.username = 'renamed'
+        user.save()
+        response = self.client.get(url, {'include': 'author'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['author'], 'renamed')
+
+    def test_article_list_pagination(self):
+        self.SetUp()
+        self.article_pb1.tags.add('music')
+        for i in range(4):
+            article_create(author=self.user, title=f'{self.title}{i}', body=self.body, status='PB', slug=f'{self.slug}-{i}')
+        url = reverse('api:article_list')
+        ids = list(Article.published.order_by('-publish', '-id').values_list('id', flat=True))
+        response = self.client.get(url, {'page_size': 4})
+        self.assertEqual([item['id'] for item in response.data['results']], ids[:4])
+        self.assertIsNone(response.data['previous'])
+        self.assertNotIn('author', response.data['results'][0])
+        self.assertNotIn('tags', response.data['results'][0])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([item['id'] for item in response.data['results']], ids[4:])
+        self.assertIsNone(response.data['next'])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([item['id'] for item in response.data['results']], ids[:4])
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'fields': 'id,title'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title'})
+        response = self.client.get(url, {'fields': 'id', 'include': 'author,tags'})
+        item = next(item for item in response.data['results'] if item['id'] == self.article_pb1.id)
+        self.assertEqual(item, {'id': self.article_pb1.id, 'author': self.user.username, 'tags': [{'name': 'music'}]})
+        self.assertEqual(self.client.get(url, {'fields': 'body'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url, {'cursor': 'nonsense'}).status_code, status.HTTP_404_NOT_FOUND)
+        redis = redis_create()
+        for key in redis.scan_iter('tag:*:articles'):
+            redis.delete(key)
+        tagged = list(Article.published.order_by('-publish', '-id')[:3])
+        for article in tagged:
+            article.tags.add('guitar')
+        response = self.client.get(url, {'tag': 'guitar', 'page_size': 2})
+        self.assertEqual([item['id'] for item in response.data['results']], [article.id for article in tagged[:2]])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([item['id'] for item in response.data['results']], [tagged[2].id])
+        self.assertIsNone(response.data['next'])
+        response = self.client.get(url, {'tag': ['guitar', 'nonexistent']})
+        self.assertEqual(response.data['results'], [])
+
+    def test_query_budgets(self):
+        self.SetUp()
+        users = [get_user_model().objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='pw')
+                 for i in range(4)]
+        for article in (self.article_pb1, self.article_pb2):
+            article.tags.add('music', 'rock')
+            for user in users:
+                comment_create(user, self.body, article)
+        for client_user in (None, self.user):
+            self.client.force_authenticate(client_user)
+            self.assertWithinBudget(reverse('api:article_list'))
+            self.assertWithinBudget(reverse('api:article_list'), {'include': 'author,tags'})
+            self.assertWithinBudget(reverse('api:article_detail', args=(self.article_pb1.id, )))
+            self.assertWithinBudget(reverse('api:article_related', args=(self.article_pb1.id, )))
+            self.assertWithinBudget(reverse('api:user_list'))
+            self.assertWithinBudget(reverse('api:user_comments', args=(users[0].id, )))
+            self.assertWithinBudget(reverse('api:tag_list'))
+        self.assertWithinBudget(reverse('api:comment_create', args=(self.article_pb1.id, )), {'body': 'budget'},
+                                method='post')
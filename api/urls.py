@@ -6,9 +6,13 @@ app_name = 'api'
 urlpatterns = [
     path('', views.ArticleList.as_view(), name='article_list'),
     path('<int:pk>/', views.ArticleDetail.as_view(), name='article_detail'),
+    path('<int:pk>/related/', views.RelatedArticleList.as_view(), name='article_related'),
     path('article/create/', views.ArticleCreate.as_view(), name='article_create'),
+    path('article/bulk-create/', views.ArticleBulkCreate.as_view(), name='article_bulk_create'),
     path('article/<int:pk>/delete/', views.ArticleDelete.as_view(), name='article_delete'),
     path('article/<int:article_id>/comment/create/', views.CommentCreate.as_view(), name='comment_create'),
     path('comment/<int:pk>/delete/', views.CommentDelete.as_view(), name='comment_delete'),
     path('user/', views.UserList.as_view(), name='user_list'),
+    path('user/<int:pk>/comments/', views.UserCommentList.as_view(), name='user_comments'),
+    path('tag/', views.TagList.as_view(), name='tag_list'),
 ]
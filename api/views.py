@@ -1,8 +1,12 @@
 from django.http import Http404
-from blog.models import Article, Comment
+from blog.models import Article, ArticleCounter, Comment
 from django.contrib.auth import get_user_model
-from rest_framework import generics
-from django.db.models import Q
+from rest_framework import generics, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from django.db.models import Count, F, Max, Prefetch, Q, Window
+from django.db.models.functions import RowNumber
+from django.shortcuts import get_object_or_404
 from . import serializers
 from django.contrib.auth import get_user_model
 from rest_framework.permissions import IsAuthenticated
@@ -10,28 +14,170 @@ from .permissions import IsAuthor
 from django.utils import timezone
 from django.utils.text import slugify
 from unidecode import unidecode
-from django.views.decorators.cache import cache_page
-from django.utils.decorators import method_decorator
+from taggit.models import Tag
+from blog.bulk import bulk_create_articles
+from blog.indexes import related_articles, TAGGED_MATCHES
+from blog.caching import cached, comments_namespace, drafts_namespace, get_version, make_key, version_datetime, \
+    API_TIMEOUT, ARTICLE_LIST, USERS
+from forum.conditional import ConditionalGetMixin
+from forum.query_budget import query_budget
+from .pagination import ArticleCursorPagination, CommentCursorPagination, UserCursorPagination
 
 
-@method_decorator(cache_page(60 * 15), name='dispatch')
-class ArticleList(generics.ListAPIView):
+LATEST_COMMENTS = 5
+
+
+def api_key(namespace, *parts):
+    return make_key(namespace, 'api', *parts)
+
+
+def cached_page(view, key):
+    def page():
+        objects = view.paginate_queryset(view.get_queryset())
+        return view.paginator.get_paginated_data(view.get_serializer(objects, many=True).data)
+
+    return view.paginator.get_linked_response(view.request, cached(key, page, API_TIMEOUT))
+
+
+def split_param(request, name):
+    return [value for values in request.query_params.getlist(name) for value in values.split(',') if value]
+
+
+@query_budget(queries=6, redis=3)
+class ArticleList(ConditionalGetMixin, generics.ListAPIView):
     serializer_class = serializers.ArticleListSerializer
+    pagination_class = ArticleCursorPagination
 
-    def get_queryset(self):
+    def get_tags(self):
+        return set(self.request.query_params.getlist('tag'))
+
+    def get_tag_filter(self):
+        # (tag ids, match) for ArticleCursorPagination, None without tags
+        tags = self.get_tags()
+        if not tags:
+            return None
+        match = self.request.query_params.get('match')
+        match = match if match in TAGGED_MATCHES else TAGGED_MATCHES[0]
+        tag_ids = list(Tag.objects.filter(slug__in=tags).values_list('id', flat=True))
+        if match == 'all' and len(tag_ids) < len(tags):
+            tag_ids = []
+        return tag_ids, match
+
+    def get_field_names(self):
+        # ?fields= narrows the plain fields, ?include= adds expansions
+        serializer_class = self.get_serializer_class()
+        expansions = serializer_class.expansions
+        plain = [name for name in serializer_class.Meta.fields if name not in expansions]
+        fields = split_param(self.request, 'fields') or plain
+        include = split_param(self.request, 'include')
+        unknown = {'fields': sorted(set(fields) - set(plain)), 'include': sorted(set(include) - set(expansions))}
+        unknown = {param: names for param, names in unknown.items() if names}
+        if unknown:
+            raise ValidationError(unknown)
+        return [*fields, *include]
+
+    def get_serializer(self, *args, **kwargs):
+        return super().get_serializer(*args, fields=self.get_field_names(), **kwargs)
+
+    def get_namespaces(self):
+        # Published articles are shared by everyone, the viewer's own drafts
+        # live in a namespace of their own
         user = self.request.user
-        return Article.objects.filter(Q(status='PB') | Q(author__username=user)).select_related('author').prefetch_related('tags')
+        if user.is_authenticated and not self.get_tags():
+            return ARTICLE_LIST, drafts_namespace(user.id)
+        return ARTICLE_LIST,
+
+    def get_validators(self, request, *args, **kwargs):
+        namespaces = self.get_namespaces()
+        return ((request.get_full_path(), *[get_version(namespace) for namespace in namespaces]),
+                max(version_datetime(namespace) for namespace in namespaces))
+
+    def has_drafts(self):
+        namespaces = self.get_namespaces()
+        if len(namespaces) < 2:
+            return False
+        return cached(api_key(namespaces[1], 'exists'), lambda: Article.objects.filter(
+            author=self.request.user, status=Article.Status.DRAFT).exists(), API_TIMEOUT)
+
+    def get_queryset(self):
+        names = self.get_field_names()
+        columns = {field.attname for field in Article._meta.concrete_fields if field.attname in names}
+        columns.update(('id', 'publish'))
+        if self.has_drafts():
+            queryset = Article.objects.filter(Q(status=Article.Status.PUBLISHED) |
+                                              Q(author=self.request.user, status=Article.Status.DRAFT))
+        else:
+            queryset = Article.published.all()
+        if 'author' in names:
+            queryset = queryset.select_related('author')
+            columns.add('author__username')
+        if 'tags' in names:
+            queryset = queryset.prefetch_related('tags')
+        return queryset.only(*columns)
+
+    def list(self, request, *args, **kwargs):
+        if self.has_drafts():
+            # Mixed with the shared articles, so also keyed by their version
+            return cached_page(self, api_key(self.get_namespaces()[1], get_version(ARTICLE_LIST),
+                                             request.get_full_path()))
+        return cached_page(self, api_key(ARTICLE_LIST, request.get_full_path()))
 
 
-@method_decorator(cache_page(60 * 15), name='dispatch')
-class ArticleDetail(generics.RetrieveAPIView):
+@query_budget(queries=6, redis=0)
+class ArticleDetail(ConditionalGetMixin, generics.RetrieveAPIView):
     serializer_class = serializers.ArticleSerializer
 
+    def get_meta(self):
+        if not hasattr(self, 'meta'):
+            self.meta = self.get_queryset().filter(pk=self.kwargs['pk'])\
+                .values('id', 'status', 'author_id', 'updated', 'views', 'comment_count').first()
+        return self.meta
+
+    def get_validators(self, request, *args, **kwargs):
+        meta = self.get_meta()
+        if meta is None:
+            return None
+        namespace = comments_namespace(meta['id'])
+        return ((meta['id'], meta['updated'], meta['views'], meta['comment_count'],
+                 get_version(namespace), get_version(ARTICLE_LIST)),
+                max(meta['updated'], version_datetime(namespace), version_datetime(ARTICLE_LIST)))
+
     def get_queryset(self):
         user = self.request.user
         return Article.objects.filter(Q(status='PB') | Q(author__username=user))
+
+    def get_object(self):
+        queryset = self.get_queryset().select_related('author').prefetch_related(
+            'tags', Prefetch('comments', queryset=Comment.objects.select_related('author')))
+        article = get_object_or_404(queryset, pk=self.kwargs['pk'])
+        self.check_object_permissions(self.request, article)
+        return article
+
+    def retrieve(self, request, *args, **kwargs):
+        meta = self.get_meta()
+        if meta is None:
+            raise Http404
+        if meta['status'] == Article.Status.PUBLISHED:
+            key = api_key(ARTICLE_LIST, meta['id'], meta['views'], get_version(comments_namespace(meta['id'])))
+        else:
+            # Only the author gets this far for a draft
+            key = api_key(drafts_namespace(meta['author_id']), meta['id'])
+        return Response(cached(key, lambda: super(ArticleDetail, self).retrieve(request, *args, **kwargs).data,
+                               API_TIMEOUT))
     
 
+@query_budget(queries=4, redis=1)
+class RelatedArticleList(ConditionalGetMixin, generics.ListAPIView):
+    serializer_class = serializers.ArticleListSerializer
+
+    def get_validators(self, request, *args, **kwargs):
+        return (kwargs['pk'], get_version(ARTICLE_LIST)), version_datetime(ARTICLE_LIST)
+
+    def get_queryset(self):
+        return related_articles(self.kwargs['pk'],
+                                queryset=Article.published.select_related('author').prefetch_related('tags'))
+
+
 class ArticleCreate(generics.CreateAPIView):
     serializer_class = serializers.ArticleSerializer
     permission_classes = [IsAuthenticated]
@@ -41,17 +187,92 @@ class ArticleCreate(generics.CreateAPIView):
                         slug=slugify(unidecode(serializer.validated_data['title'])))
 
 
+class ArticleBulkCreate(generics.GenericAPIView):
+    serializer_class = serializers.ArticleBulkItemSerializer
+    permission_classes = [IsAuthenticated]
+    max_articles = 1000
+
+    def post(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            return Response({'detail': 'Expected a list of articles.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(request.data) > self.max_articles:
+            return Response({'detail': f'At most {self.max_articles} articles per request.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        valid, positions, errors = [], [], {}
+        for position, item in enumerate(request.data):
+            serializer = self.get_serializer(data=item)
+            if serializer.is_valid():
+                valid.append(serializer.validated_data)
+                positions.append(position)
+            else:
+                errors[position] = serializer.errors
+        articles = bulk_create_articles(request.user, valid) if valid else []
+        created = [{'index': position, 'id': article.id} for position, article in zip(positions, articles)]
+        return Response({'created': created, 'errors': errors},
+                        status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST)
+
+
 class ArticleDelete(generics.DestroyAPIView):
     permission_classes = [IsAuthenticated, IsAuthor]
     queryset = Article.objects.all()
 
 
-@method_decorator(cache_page(60 * 15), name='dispatch')
-class UserList(generics.ListAPIView):
+def latest_comments(limit=LATEST_COMMENTS):
+    # Ranked per author by a window function, so a page of users gets its
+    # capped comments in one query however many each user has written
+    rank = Window(RowNumber(), partition_by=F('author_id'), order_by=(F('created').desc(), F('id').desc()))
+    return Comment.objects.annotate(rank=rank).filter(rank__lte=limit)\
+                          .only('id', 'author_id', 'article_id', 'body', 'created')
+
+
+@query_budget(queries=4, redis=0)
+class UserList(ConditionalGetMixin, generics.ListAPIView):
     serializer_class = serializers.UserSerializer
-    queryset = get_user_model().objects.all().prefetch_related('comments_published')
+    pagination_class = UserCursorPagination
+
+    def get_queryset(self):
+        return get_user_model().objects.only('id', 'username', 'first_name', 'last_name', 'date_joined', 'about_self')\
+            .prefetch_related(Prefetch('comments_published', queryset=latest_comments(), to_attr='latest_comments'))
+
+    def get_validators(self, request, *args, **kwargs):
+        return (request.get_full_path(), get_version(USERS)), version_datetime(USERS)
+
+    def list(self, request, *args, **kwargs):
+        return cached_page(self, api_key(USERS, request.get_full_path()))
+
+
+@query_budget(queries=4, redis=0)
+class UserCommentList(ConditionalGetMixin, generics.ListAPIView):
+    serializer_class = serializers.UserCommentSerializer
+    pagination_class = CommentCursorPagination
+
+    def get_queryset(self):
+        user = get_object_or_404(get_user_model().objects.only('id'), pk=self.kwargs['pk'])
+        return Comment.objects.filter(author=user).only('id', 'article_id', 'body', 'created')
+
+    def get_validators(self, request, *args, **kwargs):
+        return (request.get_full_path(), get_version(USERS)), version_datetime(USERS)
+
+    def list(self, request, *args, **kwargs):
+        return cached_page(self, api_key(USERS, request.get_full_path()))
+
+
+@query_budget(queries=5, redis=0)
+class TagList(ConditionalGetMixin, generics.ListAPIView):
+    serializer_class = serializers.TagCountSerializer
+    queryset = Tag.objects.select_related('article_counter')
+
+    def get_validators(self, request, *args, **kwargs):
+        tags = Tag.objects.aggregate(last=Max('id'), total=Count('id'))
+        return (get_version(ARTICLE_LIST), tags['last'], tags['total']), None
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        response.data = {'articles': ArticleCounter.objects.total(), 'tags': response.data}
+        return response
 
 
+@query_budget(queries=5, redis=0)
 class CommentCreate(generics.CreateAPIView):
     serializer_class = serializers.CommentSerializer
     permission_classes = [IsAuthenticated]
@@ -0,0 +1,88 @@
+import asyncio
+from asgiref.sync import sync_to_async
+from django.contrib.auth.middleware import get_user
+from django.contrib.auth.views import redirect_to_login
+from django.db.models import prefetch_related_objects
+from django.http import Http404, HttpResponseNotAllowed
+from django.shortcuts import redirect, render
+from .models import Article
+from .forms import CommentForm
+from .indexes import acount_view, arelated_articles
+from .views import article_validators, count_view_kwargs, render_comments, ArticleDetailView
+from forum.conditional import check_validators, has_pending_messages, patch_validation_headers, set_validators
+from forum.query_budget import query_budget
+
+
+# Async versions of the article page and of posting a comment, routed in
+# place of the sync ones when ASYNC_VIEWS is on (forum/asgi.py turns it on).
+# Redis is awaited on the event loop while the ORM, which Django runs in
+# one thread per worker, and template rendering go through sync_to_async,
+# so a request waiting on either holds no thread of its own.
+
+
+def get_article(request, slug, id):
+    # The user, the session and everything the conditional check needs,
+    # in one trip to the ORM thread
+    user = get_user(request)
+    article = Article.objects.select_related('author').filter(id=id, slug=slug).first()
+    if article is None or (not article.is_published and article.author_id != user.pk):
+        raise Http404
+    validators = None if has_pending_messages(request) else article_validators(article)
+    return article, validators
+
+
+def prefetch_tags(article):
+    prefetch_related_objects([article], 'tags')
+
+
+@query_budget(queries=8, redis=2)
+async def article_detail(request, slug, id):
+    article, validators = await sync_to_async(get_article)(request, slug, id)
+    if validators is not None:
+        etag, timestamp, response = check_validators(request, validators)
+        if response is not None:
+            await acount_view(article, **count_view_kwargs(request, article))
+            set_validators(response, etag, timestamp)
+            patch_validation_headers(request, response)
+            return response
+    (comments, comments_html), related, views, _ = await asyncio.gather(
+        sync_to_async(render_comments)(article),
+        arelated_articles(article.id),
+        acount_view(article, **count_view_kwargs(request, article)),
+        sync_to_async(prefetch_tags)(article),
+    )
+    context = {
+        'article': article,
+        'comments_html': comments_html,
+        'articles_with_same_tags': related,
+        'form': CommentForm,
+        'all_views': views,
+    }
+    if comments is not None:
+        context['comments'] = comments
+    response = await sync_to_async(render)(request, ArticleDetailView.template_name, context)
+    if validators is not None:
+        set_validators(response, etag, timestamp)
+    patch_validation_headers(request, response)
+    return response
+
+
+@query_budget(queries=5, redis=0)
+async def comment_create(request, id):
+    # login_required and require_POST only take async views from Django 5.0
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    user = await sync_to_async(get_user)(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+    try:
+        article = await Article.published.aget(id=id)
+    except Article.DoesNotExist:
+        raise Http404
+    form = CommentForm(data=request.POST)
+    if form.is_valid():
+        comment = form.save(commit=False)
+        comment.article = article
+        comment.author = user
+        await comment.asave()
+    return redirect('blog:article_detail', article.slug, article.id)
@@ -0,0 +1,91 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models.signals import m2m_changed
+from django.utils import timezone
+from django.utils.text import slugify
+from taggit.models import Tag, TaggedItem
+from unidecode import unidecode
+from .models import Article, ArticleCounter, render_article_body
+from .caching import bump_version, drafts_namespace, ARTICLE_LIST, FEEDS, SEARCH
+from . import indexes, search
+
+
+# Bulk inserts skip model signals, so everything the signals in
+# blog.signals maintain for a published article is updated here in batches.
+
+def index_tags(tags):
+    for tag in tags:
+        indexes.autocomplete_tag(tag)
+
+
+def get_or_create_tags(names):
+    names = set(names)
+    tags = {tag.name: tag for tag in Tag.objects.filter(name__in=names)}
+    missing = names - set(tags)
+    if missing:
+        Tag.objects.bulk_create([Tag(name=name, slug=slugify(unidecode(name))) for name in missing],
+                                ignore_conflicts=True)
+        created = Tag.objects.filter(name__in=missing)
+        tags.update({tag.name: tag for tag in created})
+        for name in missing - set(tags):
+            # Slug clashed with an existing tag; let taggit pick a unique one
+            tags[name] = Tag.objects.create(name=name)
+        # Not indexed before the tags are committed, a rollback would leave
+        # them behind in Redis
+        new_tags = [tags[name] for name in missing]
+        transaction.on_commit(lambda: index_tags(new_tags))
+    return tags
+
+
+def bulk_create_articles(author, items, batch_size=1000):
+    # items are dicts with title, body, status, tags (names) and optionally publish
+    articles = []
+    for item in items:
+        body_html, excerpt_html = render_article_body(item['body'])
+        articles.append(Article(author=author,
+                                title=item['title'],
+                                slug=slugify(unidecode(item['title'])),
+                                body=item['body'],
+                                body_html=body_html,
+                                excerpt_html=excerpt_html,
+                                status=item.get('status', Article.Status.DRAFT),
+                                publish=item.get('publish') or timezone.now()))
+    content_type = ContentType.objects.get_for_model(Article)
+    with transaction.atomic():
+        tags = get_or_create_tags(name for item in items for name in item.get('tags', ()))
+        Article.objects.bulk_create(articles, batch_size=batch_size)
+        TaggedItem.objects.bulk_create([TaggedItem(content_type=content_type, object_id=article.id, tag=tags[name])
+                                        for article, item in zip(articles, items)
+                                        for name in set(item.get('tags', ()))],
+                                       batch_size=batch_size)
+        published = [(article, sorted(set(item.get('tags', ()))))
+                     for article, item in zip(articles, items) if article.is_published]
+        if published:
+            ArticleCounter.objects.recount({None} | {tags[name].id for _, names in published for name in names})
+            search.index_articles(published)
+    if published:
+        tag_ids = {article.id: [tags[name].id for name in names] for article, names in published}
+        indexes.add_related_batch(tag_ids)
+        indexes.add_tagged_articles((article, tag_ids[article.id]) for article, _ in published)
+        for article, _ in published:
+            indexes.autocomplete_article(article)
+        bump_version(ARTICLE_LIST, SEARCH, FEEDS)
+    if len(published) < len(articles):
+        bump_version(drafts_namespace(author.id))
+    return articles
+
+
+def add_tags(article, tag_ids):
+    # article.tags.add() runs a get_or_create per tag; this inserts them in
+    # one statement and sends the same m2m_changed signals as taggit
+    new_ids = set(Tag.objects.filter(id__in=tag_ids).exclude(id__in=article.tags.values('id'))
+                             .values_list('id', flat=True))
+    if not new_ids:
+        return
+    signal = dict(sender=TaggedItem, instance=article, reverse=False, model=Tag, pk_set=new_ids,
+                  using=article._state.db)
+    m2m_changed.send(action='pre_add', **signal)
+    content_type = ContentType.objects.get_for_model(Article)
+    TaggedItem.objects.bulk_create([TaggedItem(content_type=content_type, object_id=article.id, tag_id=tag_id)
+                                    for tag_id in new_ids])
+    m2m_changed.send(action='post_add', **signal)
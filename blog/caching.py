@@ -0,0 +1,109 @@
+import datetime
+import hashlib
+import time
+from django.core.cache import cache
+from django.utils.translation import get_language
+from forum.query_budget import record_cache
+
+
+ARTICLE_LIST = 'article_list'
+ARTICLE_LIST_TIMEOUT = 60 * 15
+
+COMMENTS_TIMEOUT = 60 * 60
+
+USERS = 'users'
+API_TIMEOUT = 60 * 60
+
+FEEDS = 'feeds'
+FEEDS_TIMEOUT = 60 * 60
+
+SEARCH = 'search'
+SEARCH_TIMEOUT = 60 * 10
+# Only the pages inside the first SEARCH_MAX_RESULTS ranked hits are cached
+SEARCH_MAX_RESULTS = 500
+
+
+# Every cached namespace carries a version; bumping it orphans all entries
+# written under the previous one, which then simply expire.
+
+def get_version(namespace):
+    key = f'{namespace}:version'
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_version(*namespaces):
+    cache.set_many({f'{namespace}:version': time.time_ns() for namespace in namespaces}, None)
+
+
+def version_datetime(namespace):
+    return datetime.datetime.fromtimestamp(get_version(namespace) / 1e9, tz=datetime.timezone.utc)
+
+
+def make_key(namespace, *parts):
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'{namespace}:{get_version(namespace)}:{digest}'
+
+
+def article_list_key(tags, match, cursor):
+    return make_key(ARTICLE_LIST, get_language(), ','.join(sorted(tags)), match, cursor or '')
+
+
+def cache_get(key):
+    value = cache.get(key)
+    record_cache(value is not None)
+    return value
+
+
+def cached(key, compute, timeout):
+    value = cache_get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout)
+    return value
+
+
+def drafts_namespace(user_id):
+    # Everything showing the drafts of one author
+    return f'drafts:{user_id}'
+
+
+def comments_namespace(article_id):
+    return f'comments:{article_id}'
+
+
+def comments_key(article_id, cursor):
+    return make_key(comments_namespace(article_id), get_language(), cursor or '')
+
+
+def record_hit(namespace, hit):
+    key = f'{namespace}:stats:{"hits" if hit else "misses"}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, None)
+
+
+def get_stats(namespace):
+    stats = cache.get_many([f'{namespace}:stats:hits', f'{namespace}:stats:misses'])
+    hits = stats.get(f'{namespace}:stats:hits', 0)
+    misses = stats.get(f'{namespace}:stats:misses', 0)
+    return {'hits': hits, 'misses': misses, 'ratio': hits / (hits + misses) if hits + misses else 0}
+
+
+def reset_stats(namespace):
+    cache.delete_many([f'{namespace}:stats:hits', f'{namespace}:stats:misses'])
+
+
+def cached_search(normalized_query, part, compute):
+    key = make_key(SEARCH, get_language(), normalized_query, part)
+    value = cache_get(key)
+    record_hit(SEARCH, value is not None)
+    if value is None:
+        value = compute()
+        cache.set(key, value, SEARCH_TIMEOUT)
+    return value
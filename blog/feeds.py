@@ -1,8 +1,17 @@
-import markdown
 from django.contrib.syndication.views import Feed 
-from django.template.defaultfilters import truncatewords_html 
-from django.urls import reverse_lazy
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse, reverse_lazy
+from django.utils.translation import get_language
+from django.views.decorators.http import condition
+from taggit.models import Tag
 from .models import Article
+from .caching import cache_get, make_key, get_version, version_datetime, FEEDS, FEEDS_TIMEOUT
+from .indexes import tagged_article_ids
+
+
+FEED_ITEMS = 5
 
 
 class LatestArticlesFeed(Feed):
@@ -11,13 +20,62 @@ class LatestArticlesFeed(Feed):
     description = 'Recent topics and publications'
 
     def items(self):
-        return Article.published.all()[:5]
+        return Article.published.only('id', 'slug', 'title', 'publish', 'excerpt_html')[:FEED_ITEMS]
     
     def item_title(self, item):
         return item.title 
     
     def item_description(self, item):
-        return truncatewords_html(markdown.markdown(item.body), 25)
+        return item.excerpt_html
     
     def item_publishdate(self, item):
         return item.publish
+
+
+class TagArticlesFeed(LatestArticlesFeed):
+    def get_object(self, request, tag):
+        return get_object_or_404(Tag, slug=tag)
+
+    def title(self, tag):
+        return f'Forum: {tag.name}'
+
+    def link(self, tag):
+        return reverse('blog:article_tagged_list', args=(tag.slug, ))
+
+    def description(self, tag):
+        return f'Recent publications tagged {tag.name}'
+
+    def items(self, tag):
+        ids = tagged_article_ids([tag.id], limit=FEED_ITEMS)
+        articles = Article.published.only('id', 'slug', 'title', 'publish', 'excerpt_html').in_bulk(ids)
+        return [articles[article_id] for article_id in ids if article_id in articles]
+
+
+def cached_feed(feed):
+    # Rendered feeds are cached until the next publication bumps the FEEDS
+    # version, which also serves as ETag and Last-Modified, so unchanged
+    # polls get a 304 from the cache alone. The body holds absolute URLs,
+    # so the scheme and host are part of both.
+
+    def etag(request, tag=''):
+        return f'"{get_version(FEEDS)}-{request.scheme}-{request.get_host()}-{get_language()}-{tag}"'
+
+    def last_modified(request, tag=''):
+        return version_datetime(FEEDS)
+
+    @condition(etag_func=etag, last_modified_func=last_modified)
+    def view(request, **kwargs):
+        key = make_key(FEEDS, request.scheme, request.get_host(), get_language(), kwargs.get('tag', ''))
+        cached = cache_get(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+        response = feed(request, **kwargs)
+        cache.set(key, (response.content, response['Content-Type']), FEEDS_TIMEOUT)
+        return response
+
+    return view
+
+
+latest_articles_feed = cached_feed(LatestArticlesFeed())
+tag_articles_feed = cached_feed(TagArticlesFeed())
@@ -0,0 +1,547 @@
+import json
+from collections import Counter, defaultdict
+from django.db.models import Case, IntegerField, Value, When
+from django.contrib.auth import get_user_model
+from taggit.models import Tag, TaggedItem
+from .models import Article
+from .pagination import KeysetPage, KeysetPaginator
+from forum.redis import async_client, degrade, pipeline, r, skip_on_outage
+
+
+# Tag index: tag:{id}:articles is a sorted set of the published articles
+# with that tag scored by their publish timestamp. Multi-tag filters are
+# answered by intersecting or unioning these sets. Every write to the index
+# increments tags:version, which names the combined sets, so a combined set
+# is reused until the index changes or it expires.
+
+TAGGED_MATCHES = ('all', 'any')
+TAGS_VERSION_KEY = 'tags:version'
+COMBINED_TAGS_TIMEOUT = 30
+# Commands a rebuild queues before flushing its pipeline
+PIPELINE_CHUNK = 5000
+
+
+def tag_articles_key(tag_id):
+    return f'tag:{tag_id}:articles'
+
+
+@skip_on_outage
+def add_tagged_article(article, tag_ids):
+    pipe = pipeline()
+    for tag_id in tag_ids:
+        pipe.zadd(tag_articles_key(tag_id), {article.id: article.publish.timestamp()})
+    pipe.incr(TAGS_VERSION_KEY)
+    pipe.execute()
+
+
+@skip_on_outage
+def add_tagged_articles(articles_with_tag_ids):
+    pipe = pipeline()
+    for article, tag_ids in articles_with_tag_ids:
+        for tag_id in tag_ids:
+            pipe.zadd(tag_articles_key(tag_id), {article.id: article.publish.timestamp()})
+    pipe.incr(TAGS_VERSION_KEY)
+    pipe.execute()
+
+
+@skip_on_outage
+def remove_tagged_article(article_id, tag_ids):
+    pipe = pipeline()
+    for tag_id in tag_ids:
+        pipe.zrem(tag_articles_key(tag_id), article_id)
+    pipe.incr(TAGS_VERSION_KEY)
+    pipe.execute()
+
+
+@skip_on_outage
+def remove_tag_index(tag_id):
+    pipe = pipeline()
+    pipe.delete(tag_articles_key(tag_id))
+    pipe.incr(TAGS_VERSION_KEY)
+    pipe.execute()
+
+
+# Returns the name of the combined set for the current tags:version,
+# building it first unless a request already did, in one round trip
+combine_tags_script = r.register_script("""
+local key = ARGV[3] .. ':' .. (redis.call('GET', KEYS[1]) or '0')
+if redis.call('EXISTS', key) == 0 then
+    local args = {ARGV[1], key, #KEYS - 1}
+    for i = 2, #KEYS do
+        args[#args + 1] = KEYS[i]
+    end
+    args[#args + 1] = 'AGGREGATE'
+    args[#args + 1] = 'MAX'
+    redis.call(unpack(args))
+    redis.call('EXPIRE', key, ARGV[2])
+end
+return key
+""")
+
+
+def combine_tag_indexes(tag_ids, match='all'):
+    tag_ids = sorted(set(tag_ids))
+    if len(tag_ids) == 1:
+        return tag_articles_key(tag_ids[0])
+    command = 'ZUNIONSTORE' if match == 'any' else 'ZINTERSTORE'
+    key = combine_tags_script(keys=[TAGS_VERSION_KEY, *(tag_articles_key(tag_id) for tag_id in tag_ids)],
+                              args=[command, COMBINED_TAGS_TIMEOUT, f'tags:{match}:{",".join(map(str, tag_ids))}'])
+    return key.decode()
+
+
+def tagged_article_ids_from_db(tag_ids, match='all', limit=None):
+    # The same ids, filtered by the database while Redis is unreachable
+    articles = Article.published.order_by('-publish', '-id')
+    if match == 'any':
+        articles = articles.filter(tags__id__in=tag_ids).distinct()
+    else:
+        for tag_id in tag_ids:
+            articles = articles.filter(tags__id=tag_id)
+    ids = articles.values_list('id', flat=True)
+    return list(ids[:limit] if limit else ids)
+
+
+@degrade(tagged_article_ids_from_db)
+def tagged_article_ids(tag_ids, match='all', limit=None):
+    if not tag_ids:
+        return []
+    stop = limit - 1 if limit else -1
+    return [int(article_id) for article_id in r.zrevrange(combine_tag_indexes(tag_ids, match), 0, stop)]
+
+
+def rebuild_tag_index():
+    # Built under temporary keys renamed over the live ones, so tagged
+    # pages and feeds never come up empty while this runs
+    articles_by_tag = defaultdict(dict)
+    tagged = TaggedItem.objects.filter(content_type__app_label='blog',
+                                       content_type__model='article',
+                                       object_id__in=Article.published.values('id'))
+    publish = dict(Article.published.values_list('id', 'publish'))
+    for tag_id, article_id in tagged.values_list('tag_id', 'object_id').iterator():
+        articles_by_tag[tag_id][article_id] = publish[article_id].timestamp()
+    stale = {key.decode() for key in r.scan_iter(tag_articles_key('*'))}
+    pipe = pipeline()
+    for tag_id, scores in articles_by_tag.items():
+        key = tag_articles_key(tag_id)
+        pipe.delete(f'{key}:rebuild')
+        pipe.zadd(f'{key}:rebuild', scores)
+        pipe.rename(f'{key}:rebuild', key)
+        stale.discard(key)
+        if len(pipe) >= PIPELINE_CHUNK:
+            pipe.execute()
+    for key in stale:
+        pipe.delete(key)
+    pipe.incr(TAGS_VERSION_KEY)
+    pipe.execute()
+    return len(articles_by_tag)
+
+
+class TaggedArticlePaginator(KeysetPaginator):
+    # Pages through a tag index instead of the database. Cursors are the
+    # same (publish, id) pairs KeysetPaginator uses; the page position is
+    # the cursor article's rank in the sorted set.
+
+    def __init__(self, queryset, per_page, tag_ids, match='all'):
+        super().__init__(queryset, per_page, ordering=('-publish', '-id'))
+        self.key = combine_tag_indexes(tag_ids, match) if tag_ids else None
+
+    def _position(self, values, reverse):
+        publish, article_id = values
+        rank = r.zrevrank(self.key, article_id)
+        if rank is None:
+            # The cursor article left the index; start where it would have been
+            return r.zcount(self.key, f'({publish.timestamp()}', '+inf')
+        return rank if reverse else rank + 1
+
+    def page(self, cursor=None):
+        if self.key is None:
+            return KeysetPage([])
+        reverse = False
+        start = 0
+        if cursor:
+            values, reverse = self.decode_cursor(cursor)
+            start = self._position(values, reverse)
+        if reverse:
+            stop, start = start, max(start - self.per_page, 0)
+            ids = r.zrevrange(self.key, start, stop - 1) if stop else []
+            has_next = True
+        else:
+            ids = r.zrevrange(self.key, start, start + self.per_page)
+            has_next = len(ids) > self.per_page
+            ids = ids[:self.per_page]
+        has_previous = start > 0
+        ids = [int(article_id) for article_id in ids]
+        articles = self.queryset.in_bulk(ids)
+        items = [articles[article_id] for article_id in ids if article_id in articles]
+        next_cursor = self.encode_cursor(items[-1]) if items and has_next else None
+        previous_cursor = self.encode_cursor(items[0], reverse=True) if items and has_previous else None
+        return KeysetPage(items, next_cursor, previous_cursor)
+
+
+# Related articles: article:{id}:related is a sorted set of the other
+# published articles scored by the number of tags they share with it.
+# An article is only paired with the RELATED_TAG_SAMPLE most recent articles
+# of each of its tags, and every set keeps its RELATED_SIZE best members, so
+# the work per save and the memory per article stay bounded however popular
+# a tag gets.
+# The sample is taken again whenever a tag is removed, and by then newer
+# articles may have pushed some of the pairs made when it was added out of
+# it. Those pairs keep their point, so scores drift upwards until the daily
+# rebuild_related_index task (CELERY_BEAT_SCHEDULE) recomputes them.
+
+RELATED_SIZE = 50
+RELATED_TAG_SAMPLE = 200
+
+
+def related_key(article_id):
+    return f'article:{article_id}:related'
+
+
+def published_ids_with_tags(tag_ids):
+    # The most recent members of several tag indexes in one round trip
+    tag_ids = list(tag_ids)
+    pipe = pipeline()
+    for tag_id in tag_ids:
+        pipe.zrevrange(tag_articles_key(tag_id), 0, RELATED_TAG_SAMPLE - 1)
+    return {tag_id: [int(article_id) for article_id in article_ids]
+            for tag_id, article_ids in zip(tag_ids, pipe.execute())}
+
+
+def _change_shared_tags(article_id, tag_ids, amount):
+    pipe = pipeline()
+    touched = {article_id}
+    for other_ids in published_ids_with_tags(tag_ids).values():
+        for other_id in other_ids:
+            if other_id == article_id:
+                continue
+            pipe.zincrby(related_key(article_id), amount, other_id)
+            pipe.zincrby(related_key(other_id), amount, article_id)
+            touched.add(other_id)
+    trim_related(pipe, touched)
+    pipe.execute()
+
+
+def trim_related(pipe, article_ids):
+    for article_id in article_ids:
+        pipe.zremrangebyscore(related_key(article_id), '-inf', 0)
+        pipe.zremrangebyrank(related_key(article_id), 0, -RELATED_SIZE - 1)
+
+
+@skip_on_outage
+def add_related_tags(article_id, tag_ids):
+    _change_shared_tags(article_id, tag_ids, 1)
+
+
+@skip_on_outage
+def remove_related_tags(article_id, tag_ids):
+    _change_shared_tags(article_id, tag_ids, -1)
+
+
+@skip_on_outage
+def add_related_batch(tag_ids_by_article):
+    # Bulk variant of add_related_tags for articles that are not indexed yet.
+    # Within a tag each new article is paired with at most
+    # RELATED_TAG_SAMPLE others, the batch's latest before it first, so the
+    # work grows with the batch size and not with its square.
+    articles_by_tag = defaultdict(list)
+    for article_id, tag_ids in tag_ids_by_article.items():
+        for tag_id in tag_ids:
+            articles_by_tag[tag_id].append(article_id)
+    shared = defaultdict(lambda: defaultdict(int))
+    published = published_ids_with_tags(articles_by_tag)
+    for tag_id, new_ids in articles_by_tag.items():
+        existing_ids = [other_id for other_id in published[tag_id] if other_id not in tag_ids_by_article]
+        for i, article_id in enumerate(new_ids):
+            earlier = new_ids[max(i - RELATED_TAG_SAMPLE, 0):i][::-1]
+            for other_id in (earlier + existing_ids)[:RELATED_TAG_SAMPLE]:
+                shared[article_id][other_id] += 1
+                shared[other_id][article_id] += 1
+    pipe = pipeline()
+    for article_id, scores in shared.items():
+        for other_id, score in scores.items():
+            pipe.zincrby(related_key(article_id), score, other_id)
+        if len(pipe) >= PIPELINE_CHUNK:
+            pipe.execute()
+    trim_related(pipe, shared)
+    pipe.execute()
+
+
+@skip_on_outage
+def remove_related_article(article_id):
+    pipe = pipeline()
+    for other_id in r.zrange(related_key(article_id), 0, -1):
+        pipe.zrem(related_key(int(other_id)), article_id)
+    pipe.delete(related_key(article_id))
+    pipe.execute()
+
+
+def by_shared_tags(articles, related):
+    scores = {int(member): score for member, score in related}
+    return sorted(articles.values(), key=lambda article: (-scores[article.id], -article.publish.timestamp()))
+
+
+@degrade(lambda *args, **kwargs: [])
+def related_articles(article_id, count=5, queryset=None):
+    if queryset is None:
+        queryset = Article.published.only('id', 'slug', 'title', 'publish')
+    related = r.zrevrange(related_key(article_id), 0, count - 1, withscores=True)
+    return by_shared_tags(queryset.in_bulk([int(member) for member, _ in related]), related)
+
+
+@degrade(lambda *args, **kwargs: [])
+async def arelated_articles(article_id, count=5, queryset=None):
+    if queryset is None:
+        queryset = Article.published.only('id', 'slug', 'title', 'publish')
+    related = await async_client().zrevrange(related_key(article_id), 0, count - 1, withscores=True)
+    return by_shared_tags(await queryset.ain_bulk([int(member) for member, _ in related]), related)
+
+
+def rebuild_related_index():
+    # Each set is built under a temporary key and renamed over the live
+    # one, so readers never see an empty list while this runs
+    rank = {article_id: i for i, article_id in
+            enumerate(Article.published.order_by('-publish', '-id').values_list('id', flat=True).iterator())}
+    articles_by_tag = defaultdict(list)
+    tags_by_article = defaultdict(list)
+    tagged = TaggedItem.objects.filter(content_type__app_label='blog',
+                                       content_type__model='article',
+                                       object_id__in=Article.published.values('id'))
+    for tag_id, article_id in tagged.values_list('tag_id', 'object_id').iterator():
+        articles_by_tag[tag_id].append(article_id)
+        tags_by_article[article_id].append(tag_id)
+    recent = {tag_id: sorted(article_ids, key=rank.__getitem__)[:RELATED_TAG_SAMPLE]
+              for tag_id, article_ids in articles_by_tag.items()}
+    stale = {key.decode() for key in r.scan_iter(related_key('*'))}
+    written = 0
+    pipe = pipeline()
+    for article_id, tag_ids in tags_by_article.items():
+        shared = Counter(other_id for tag_id in tag_ids for other_id in recent[tag_id] if other_id != article_id)
+        if not shared:
+            continue
+        key = related_key(article_id)
+        pipe.delete(f'{key}:rebuild')
+        pipe.zadd(f'{key}:rebuild', dict(shared.most_common(RELATED_SIZE)))
+        pipe.rename(f'{key}:rebuild', key)
+        stale.discard(key)
+        written += 1
+        if len(pipe) >= PIPELINE_CHUNK:
+            pipe.execute()
+    for key in stale:
+        pipe.delete(key)
+    pipe.execute()
+    return written
+
+
+# View counting: article:{id}:views is the live counter, seeded from the
+# persisted Article.views column. Articles whose counter moved are kept in
+# article:views:dirty until flush_article_views writes them back in bulk.
+# user:{id}:viewed is a bitmap with the bit at each viewed article's id set,
+# so it never holds more than max(article id) / 8 bytes.
+
+VIEWS_DIRTY_KEY = 'article:views:dirty'
+
+count_view_script = r.register_script("""
+local counted = ARGV[2] == '1'
+if counted and #KEYS == 3 then
+    counted = redis.call('SETBIT', KEYS[3], ARGV[1], 1) == 0
+end
+redis.call('SETNX', KEYS[1], ARGV[3])
+if counted then
+    redis.call('SADD', KEYS[2], ARGV[1])
+    return redis.call('INCR', KEYS[1])
+end
+return tonumber(redis.call('GET', KEYS[1]))
+""")
+
+
+def views_key(article_id):
+    return f'article:{article_id}:views'
+
+
+def viewed_key(user_id):
+    return f'user:{user_id}:viewed'
+
+
+def count_view_keys(article_id, user_id):
+    keys = [views_key(article_id), VIEWS_DIRTY_KEY]
+    if user_id is not None:
+        keys.append(viewed_key(user_id))
+    return keys
+
+
+@degrade(lambda article, *args, **kwargs: article.views)
+def count_view(article, user_id=None, count=True):
+    # Deduplicates, increments and reads the counter in a single round trip
+    return count_view_script(keys=count_view_keys(article.id, user_id), args=[article.id, int(count), article.views])
+
+
+@degrade(lambda article, *args, **kwargs: article.views)
+async def acount_view(article, user_id=None, count=True):
+    script = async_client().cached_script(count_view_script.script)
+    return await script(keys=count_view_keys(article.id, user_id), args=[article.id, int(count), article.views])
+
+
+@degrade(lambda *args: False)
+def has_read(user_id, article_id):
+    return bool(r.getbit(viewed_key(user_id), article_id))
+
+
+@degrade(lambda *args: set())
+def read_article_ids(user_id, article_ids):
+    article_ids = list(article_ids)
+    if not article_ids:
+        return set()
+    bits = r.bitfield(viewed_key(user_id))
+    for article_id in article_ids:
+        bits.get('u1', article_id)
+    return {article_id for article_id, bit in zip(article_ids, bits.execute()) if bit}
+
+
+def migrate_viewed_sets():
+    # Converts the legacy user:{id}:viewed_articles sets into bitmaps
+    migrated = 0
+    for key in r.scan_iter('user:*:viewed_articles'):
+        user_id = key.split(b':')[1].decode()
+        pipe = r.pipeline()
+        for article_id in r.smembers(key):
+            pipe.setbit(viewed_key(user_id), int(article_id), 1)
+        pipe.delete(key)
+        pipe.execute()
+        migrated += 1
+    return migrated
+
+
+def flush_article_views(batch_size=1000):
+    flushed = 0
+    while True:
+        article_ids = [int(article_id) for article_id in r.spop(VIEWS_DIRTY_KEY, batch_size)]
+        if not article_ids:
+            return flushed
+        views = dict(zip(article_ids, r.mget([views_key(article_id) for article_id in article_ids])))
+        views = {article_id: int(count) for article_id, count in views.items() if count is not None}
+        if not views:
+            continue
+        try:
+            Article.objects.filter(id__in=views).update(views=Case(
+                *[When(id=article_id, then=Value(count)) for article_id, count in views.items()],
+                output_field=IntegerField(),
+            ))
+        except Exception:
+            r.sadd(VIEWS_DIRTY_KEY, *article_ids)
+            raise
+        flushed += len(views)
+
+
+@degrade(lambda articles: {article.id: article.views for article in articles})
+def live_view_counts(articles):
+    # Persisted count of each article, raised to its live counter where one exists
+    articles = list(articles)
+    if not articles:
+        return {}
+    live = r.mget([views_key(article.id) for article in articles])
+    return {article.id: max(article.views, int(views or 0)) for article, views in zip(articles, live)}
+
+
+def requeue_view_counters():
+    # Marks every live counter dirty so the next flush persists all of them
+    article_ids = [key.split(b':')[1] for key in r.scan_iter(views_key('*'))]
+    if article_ids:
+        r.sadd(VIEWS_DIRTY_KEY, *article_ids)
+    return len(article_ids)
+
+
+# Autocomplete: autocomplete:{kind} is a sorted set with every member scored
+# 0, so ZRANGEBYLEX answers prefix queries. Members are the casefolded text,
+# a NUL separator and a JSON payload; autocomplete:{kind}:members maps ids
+# to their current member so renames can drop the old entry.
+
+AUTOCOMPLETE_KINDS = ('articles', 'tags', 'users')
+
+
+def autocomplete_key(kind):
+    return f'autocomplete:{kind}'
+
+
+def _autocomplete_member(text, payload):
+    return f'{text.casefold()}\x00{json.dumps(payload, ensure_ascii=False)}'
+
+
+@skip_on_outage
+def autocomplete_add(kind, item_id, text, payload):
+    member = _autocomplete_member(text, payload)
+    old_member = r.hget(f'{autocomplete_key(kind)}:members', item_id)
+    pipe = r.pipeline()
+    if old_member is not None:
+        pipe.zrem(autocomplete_key(kind), old_member)
+    pipe.zadd(autocomplete_key(kind), {member: 0})
+    pipe.hset(f'{autocomplete_key(kind)}:members', item_id, member)
+    pipe.execute()
+
+
+@skip_on_outage
+def autocomplete_remove(kind, item_id):
+    old_member = r.hget(f'{autocomplete_key(kind)}:members', item_id)
+    if old_member is not None:
+        pipe = r.pipeline()
+        pipe.zrem(autocomplete_key(kind), old_member)
+        pipe.hdel(f'{autocomplete_key(kind)}:members', item_id)
+        pipe.execute()
+
+
+def _article_entry(article):
+    return article.id, article.title, {'id': article.id, 'slug': article.slug, 'title': article.title}
+
+
+def _tag_entry(tag):
+    return tag.id, tag.name, {'slug': tag.slug, 'name': tag.name}
+
+
+def _user_entry(user):
+    return user.id, user.username, {'id': user.id, 'username': user.username}
+
+
+def autocomplete_article(article):
+    if article.is_published:
+        autocomplete_add('articles', *_article_entry(article))
+    else:
+        autocomplete_remove('articles', article.id)
+
+
+def autocomplete_tag(tag):
+    autocomplete_add('tags', *_tag_entry(tag))
+
+
+def autocomplete_user(user):
+    autocomplete_add('users', *_user_entry(user))
+
+
+@degrade(lambda *args, **kwargs: {kind: [] for kind in AUTOCOMPLETE_KINDS})
+def autocomplete(prefix, limit=10):
+    prefix = prefix.casefold().encode()
+    pipe = pipeline()
+    for kind in AUTOCOMPLETE_KINDS:
+        pipe.zrangebylex(autocomplete_key(kind), b'[' + prefix, b'[' + prefix + b'\xff', 0, limit)
+    return {kind: [json.loads(member.split(b'\x00', 1)[1]) for member in members]
+            for kind, members in zip(AUTOCOMPLETE_KINDS, pipe.execute())}
+
+
+def rebuild_autocomplete_index(batch_size=1000):
+    sources = {
+        'articles': (Article.published.only('id', 'slug', 'title'), _article_entry),
+        'tags': (Tag.objects.all(), _tag_entry),
+        'users': (get_user_model().objects.only('id', 'username'), _user_entry),
+    }
+    total = 0
+    pipe = pipeline()
+    for kind, (queryset, entry) in sources.items():
+        pipe.delete(autocomplete_key(kind), f'{autocomplete_key(kind)}:members')
+        for item in queryset.iterator(chunk_size=batch_size):
+            item_id, text, payload = entry(item)
+            member = _autocomplete_member(text, payload)
+            pipe.zadd(autocomplete_key(kind), {member: 0})
+            pipe.hset(f'{autocomplete_key(kind)}:members', item_id, member)
+            total += 1
+            if total % batch_size == 0:
+                pipe.execute()
+    pipe.execute()
+    return total
@@ -0,0 +1,23 @@
+import os
+from django.core.management.base import BaseCommand
+from blog.transfer import KINDS, export_lines
+
+
+class Command(BaseCommand):
+    help = 'Streams users, articles (with tags) and comments into <kind>.jsonl files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kinds', nargs='*', choices=KINDS, help='What to export, everything by default')
+        parser.add_argument('--output', default='.', help='Directory the files are written to')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        os.makedirs(options['output'], exist_ok=True)
+        for kind in options['kinds'] or KINDS:
+            path = os.path.join(options['output'], f'{kind}.jsonl')
+            total = 0
+            with open(path, 'w', encoding='utf-8') as file:
+                for line in export_lines(kind, options['chunk_size']):
+                    file.write(line)
+                    total += 1
+            self.stdout.write(self.style.SUCCESS(f'Exported {total} {kind} to {path}'))
@@ -0,0 +1,77 @@
+import itertools
+import json
+import os
+from multiprocessing import Pool
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from blog.models import ArticleCounter
+from blog.transfer import ImportConflict, KINDS, import_rows, parse_lines, reset_sequences
+
+
+class Command(BaseCommand):
+    help = 'Loads <kind>.jsonl files written by export_jsonl, resuming from a checkpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kinds', nargs='*', choices=KINDS, help='What to import, everything by default')
+        parser.add_argument('--input', default='.', help='Directory the files are read from')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes parsing lines and rendering Markdown')
+        parser.add_argument('--checkpoint', help='File recording how many lines of each kind are imported')
+        parser.add_argument('--skip-indexes', action='store_true',
+                            help='Do not recount articles and rebuild the Redis and search indexes')
+
+    def read_checkpoint(self, path):
+        if path and os.path.exists(path):
+            with open(path) as file:
+                return json.load(file)
+        return {}
+
+    def write_checkpoint(self, path, done):
+        if not path:
+            return
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump(done, file)
+        os.replace(f'{path}.tmp', path)
+
+    def batches(self, file, kind, skip, batch_size):
+        lines = itertools.islice(file, skip, None)
+        while True:
+            batch = list(itertools.islice(lines, batch_size))
+            if not batch:
+                return
+            yield kind, batch
+
+    def handle(self, *args, **options):
+        kinds = [kind for kind in KINDS if kind in (options['kinds'] or KINDS)]
+        paths = {kind: os.path.join(options['input'], f'{kind}.jsonl') for kind in kinds}
+        for path in paths.values():
+            if not os.path.exists(path):
+                raise CommandError(f'{path} does not exist')
+        checkpoint = options['checkpoint']
+        done = self.read_checkpoint(checkpoint)
+
+        # Workers only parse and render, all database work stays in this process.
+        connections.close_all()
+        with Pool(max(options['workers'], 1)) as pool:
+            for kind in kinds:
+                total = done.get(kind, 0)
+                if total:
+                    self.stdout.write(f'Resuming {kind} after line {total}')
+                with open(paths[kind], encoding='utf-8') as file:
+                    batches = self.batches(file, kind, total, options['batch_size'])
+                    # imap keeps the file order, so the checkpoint always marks a prefix
+                    for line_count, rows in pool.imap(parse_lines, batches):
+                        try:
+                            import_rows(kind, rows)
+                        except ImportConflict as e:
+                            raise CommandError(e)
+                        total += line_count
+                        done[kind] = total
+                        self.write_checkpoint(checkpoint, done)
+                self.stdout.write(self.style.SUCCESS(f'Imported {total} {kind}'))
+        reset_sequences()
+        if not options['skip_indexes']:
+            ArticleCounter.objects.recount()
+            call_command('rebuild_indexes', stdout=self.stdout)
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from blog.indexes import migrate_viewed_sets
+
+
+class Command(BaseCommand):
+    help = 'Converts the per-user viewed_articles Redis sets into bitmaps'
+
+    def handle(self, *args, **options):
+        total = migrate_viewed_sets()
+        self.stdout.write(self.style.SUCCESS(f'Migrated viewed articles of {total} users'))
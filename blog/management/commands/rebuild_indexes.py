@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from blog import indexes, search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the tag, search, related articles and autocomplete indexes and persists view counters'
+
+    def handle(self, *args, **options):
+        total = indexes.rebuild_tag_index()
+        self.stdout.write(self.style.SUCCESS(f'Tag index rebuilt for {total} tags'))
+        total = indexes.rebuild_related_index()
+        self.stdout.write(self.style.SUCCESS(f'Related articles index rebuilt for {total} articles'))
+        total = search.rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt for {total} articles'))
+        total = indexes.rebuild_autocomplete_index()
+        self.stdout.write(self.style.SUCCESS(f'Autocomplete index rebuilt with {total} entries'))
+        indexes.requeue_view_counters()
+        total = indexes.flush_article_views()
+        self.stdout.write(self.style.SUCCESS(f'View counters persisted for {total} articles'))
@@ -0,0 +1,48 @@
+import os
+from multiprocessing import Pool
+from django.core.management.base import BaseCommand
+from django.db import connections
+from blog.models import Article, render_article_body
+
+
+def render_chunk(rows):
+    return [(pk, *render_article_body(body)) for pk, body in rows]
+
+
+class Command(BaseCommand):
+    help = 'Renders article Markdown into the stored body_html and excerpt_html columns'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Re-render every article, not only the ones without stored HTML')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        workers = max(options['workers'], 1)
+        queryset = Article.objects.order_by('pk')
+        if not options['all']:
+            queryset = queryset.filter(body_html='')
+
+        # Workers only render Markdown, all database work stays in this process.
+        connections.close_all()
+        rendered_total = 0
+        last_pk = 0
+        with Pool(workers) as pool:
+            while True:
+                rows = list(queryset.filter(pk__gt=last_pk)
+                                    .values_list('pk', 'body')[:chunk_size * workers])
+                if not rows:
+                    break
+                last_pk = rows[-1][0]
+                chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+                for rendered in pool.imap_unordered(render_chunk, chunks):
+                    Article.objects.bulk_update(
+                        [Article(pk=pk, body_html=body_html, excerpt_html=excerpt_html)
+                         for pk, body_html, excerpt_html in rendered],
+                        ['body_html', 'excerpt_html'],
+                    )
+                    rendered_total += len(rendered)
+                self.stdout.write(f'Rendered {rendered_total} articles')
+        self.stdout.write(self.style.SUCCESS(f'Done, {rendered_total} articles rendered'))
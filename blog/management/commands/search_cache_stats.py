@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from blog.caching import get_stats, reset_stats, SEARCH
+
+
+class Command(BaseCommand):
+    help = 'Shows hit/miss statistics of the search result cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after printing them')
+
+    def handle(self, *args, **options):
+        stats = get_stats(SEARCH)
+        self.stdout.write(f'hits: {stats["hits"]}\n'
+                          f'misses: {stats["misses"]}\n'
+                          f'hit ratio: {stats["ratio"]:.1%}')
+        if options['reset']:
+            reset_stats(SEARCH)
+            self.stdout.write(self.style.SUCCESS('Counters reset'))
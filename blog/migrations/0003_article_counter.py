@@ -0,0 +1,43 @@
+# Generated by Django 4.2.8 on 2026-10-18 17:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.functions.comparison
+
+
+def count_published_articles(apps, schema_editor):
+    Article = apps.get_model('blog', 'Article')
+    ArticleCounter = apps.get_model('blog', 'ArticleCounter')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    published = Article._default_manager.filter(status='PB')
+    counters = [ArticleCounter(tag_id=None, published=published.count())]
+    tagged = TaggedItem.objects.filter(content_type__app_label='blog',
+                                       content_type__model='article',
+                                       object_id__in=published.values('id'))
+    for tag_id, total in tagged.values('tag_id').annotate(total=models.Count('id')).values_list('tag_id', 'total'):
+        counters.append(ArticleCounter(tag_id=tag_id, published=total))
+    ArticleCounter.objects.bulk_create(counters)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+        ('blog', '0002_article_body_html'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArticleCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('published', models.IntegerField(default=0)),
+                ('tag', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='article_counter', to='taggit.tag')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='articlecounter',
+            constraint=models.UniqueConstraint(django.db.models.functions.comparison.Coalesce('tag', models.Value(0)), name='blog_articlecounter_unique_tag'),
+        ),
+        migrations.RunPython(count_published_articles, migrations.RunPython.noop),
+    ]
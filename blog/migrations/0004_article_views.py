@@ -0,0 +1,22 @@
+# Generated by Django 4.2.8 on 2026-10-18 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0003_article_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='views',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['-views'], name='blog_articl_views_a54989_idx'),
+        ),
+    ]
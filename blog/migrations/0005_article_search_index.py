@@ -0,0 +1,47 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    Article = apps.get_model('blog', 'Article')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    if vendor == 'sqlite':
+        schema_editor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS blog_article_fts "
+                              "USING fts5(title, body, tags, tokenize='unicode61 remove_diacritics 2')")
+        insert = 'INSERT INTO blog_article_fts (rowid, title, body, tags) VALUES (%s, %s, %s, %s)'
+    elif vendor == 'postgresql':
+        schema_editor.execute('CREATE TABLE IF NOT EXISTS blog_article_search ('
+                              'article_id bigint PRIMARY KEY REFERENCES blog_article (id) '
+                              'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+                              'document tsvector NOT NULL)')
+        schema_editor.execute('CREATE INDEX IF NOT EXISTS blog_article_search_document_idx '
+                              'ON blog_article_search USING GIN (document)')
+        insert = ("INSERT INTO blog_article_search (article_id, document) VALUES (%s, "
+                  "setweight(to_tsvector('simple', %s), 'A') || "
+                  "setweight(to_tsvector('simple', %s), 'C') || "
+                  "setweight(to_tsvector('simple', %s), 'B'))")
+    else:
+        return
+    for article in Article._default_manager.filter(status='PB').only('id', 'title', 'body').iterator():
+        tags = ' '.join(TaggedItem.objects.filter(content_type__app_label='blog',
+                                                  content_type__model='article',
+                                                  object_id=article.id)
+                                          .values_list('tag__name', flat=True))
+        schema_editor.execute(insert, [article.id, article.title, article.body, tags])
+
+
+def drop_search_index(apps, schema_editor):
+    schema_editor.execute('DROP TABLE IF EXISTS blog_article_fts')
+    schema_editor.execute('DROP TABLE IF EXISTS blog_article_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+        ('blog', '0004_article_views'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
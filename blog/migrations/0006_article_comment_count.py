@@ -0,0 +1,32 @@
+# Generated by Django 4.2.8 on 2026-10-18 17:52
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_comments(apps, schema_editor):
+    Article = apps.get_model('blog', 'Article')
+    Comment = apps.get_model('blog', 'Comment')
+    comments = Comment.objects.filter(article=models.OuterRef('pk')).order_by()\
+                              .values('article').annotate(total=models.Count('id')).values('total')
+    Article._default_manager.update(comment_count=Coalesce(models.Subquery(comments), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_article_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['article', '-created'], name='blog_commen_article_3e5c99_idx'),
+        ),
+        migrations.RunPython(count_comments, migrations.RunPython.noop),
+    ]
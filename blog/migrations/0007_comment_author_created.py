@@ -0,0 +1,17 @@
+# Generated by Django 4.2.8 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_article_comment_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['author', '-created'], name='blog_commen_author__ab40d8_idx'),
+        ),
+    ]
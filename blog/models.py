@@ -1,11 +1,24 @@
+import markdown
 from django.db import models
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from django.template.defaultfilters import truncatewords_html
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from taggit.managers import TaggableManager
+from taggit.models import Tag, TaggedItem
 from django.utils.translation import gettext_lazy as _
 
 
+EXCERPT_WORDS = 30
+
+
+def render_article_body(body):
+    body_html = markdown.markdown(body)
+    return body_html, truncatewords_html(body_html, EXCERPT_WORDS)
+
+
 class IsPublished(models.Manager):
     def get_queryset(self):
         return super().get_queryset().filter(status=Article.Status.PUBLISHED)
@@ -20,9 +33,13 @@ class Article(models.Model):
     title = models.CharField(max_length=250)
     slug = models.CharField(max_length=250)
     body = models.TextField()
+    body_html = models.TextField(blank=True, editable=False)
+    excerpt_html = models.TextField(blank=True, editable=False)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     publish = models.DateTimeField(default=timezone.now)
+    views = models.PositiveIntegerField(default=0, editable=False)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
     author = models.ForeignKey(get_user_model(),
                                on_delete=models.CASCADE,    
                                related_name='articles')
@@ -33,12 +50,17 @@ class Article(models.Model):
                               default=Status.DRAFT)
     objects = models.Manager()
     tags = TaggableManager()
-    
+
+    tracked_fields = ('body', 'status')
+    # Maintained with F() updates (comment signals, view counter flushes),
+    # never written back by a plain save() of an existing row
+    counter_fields = ('comment_count', 'views')
 
     class Meta:
         ordering = ['-publish']
         indexes = [
-            models.Index(fields=['-publish'])
+            models.Index(fields=['-publish']),
+            models.Index(fields=['-views']),
         ]
 
     def __str__(self):
@@ -47,6 +69,50 @@ class Article(models.Model):
     def get_absolute_url(self):
         return reverse('blog:article_detail', args=[self.slug, self.id])
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_loaded_values()
+        return instance
+
+    def _remember_loaded_values(self):
+        self._loaded_values = {field: self.__dict__.get(field) for field in self.tracked_fields}
+
+    def loaded_value(self, field):
+        # Value of a tracked field as it was last read from or written to the database
+        return getattr(self, '_loaded_values', {}).get(field)
+
+    @property
+    def is_published(self):
+        return self.status == self.Status.PUBLISHED
+
+    @property
+    def was_published(self):
+        return self.loaded_value('status') == self.Status.PUBLISHED
+
+    def render_body(self):
+        self.body_html, self.excerpt_html = render_article_body(self.body)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        deferred = self.get_deferred_fields()
+        if update_fields is None and self.pk is not None and not self._state.adding \
+                and not kwargs.get('force_insert'):
+            # An existing row is saved without the counters (and, as Django
+            # does, without deferred fields) unless the caller names them
+            update_fields = kwargs['update_fields'] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in {*deferred, *self.counter_fields}
+            ]
+        body_saved = update_fields is None or 'body' in update_fields
+        if body_saved and 'body' not in deferred and \
+                (not self.body_html or self.body != self.loaded_value('body')):
+            self.render_body()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'body_html', 'excerpt_html'}
+        super().save(*args, **kwargs)
+        self._remember_loaded_values()
+
 
 class Comment(models.Model):
     author = models.ForeignKey(get_user_model(),
@@ -62,8 +128,72 @@ class Comment(models.Model):
     class Meta:
         ordering = ['-created']
         indexes = [
-            models.Index(fields=['-created'])
+            models.Index(fields=['-created']),
+            models.Index(fields=['article', '-created']),
+            models.Index(fields=['author', '-created']),
         ]
     
     def __str__(self):
         return self.body
+
+
+
+class ArticleCounterManager(models.Manager):
+    def total(self):
+        counter = self.filter(tag__isnull=True).first()
+        if counter is None:
+            return self.recount()[None]
+        return counter.published
+
+    def adjust(self, delta, tag_ids=(), total=True):
+        keys = set(tag_ids) | ({None} if total else set())
+        condition = models.Q(tag_id__in=keys - {None})
+        if total:
+            condition |= models.Q(tag__isnull=True)
+        counters = self.filter(condition)
+        if counters.update(published=F('published') + delta) < len(keys):
+            # Counters that did not exist yet are created from the current
+            # state, which already includes this change.
+            self.recount(keys - set(counters.values_list('tag_id', flat=True)))
+
+    def recount(self, tag_ids=None):
+        published = Article.published.all()
+        counts = {}
+        if tag_ids is None or None in tag_ids:
+            counts[None] = published.count()
+        tagged = TaggedItem.objects.filter(content_type__app_label='blog',
+                                           content_type__model='article',
+                                           object_id__in=published.values('id'))
+        if tag_ids is None:
+            tags = Tag.objects.values_list('id', flat=True)
+        else:
+            tags = [tag_id for tag_id in tag_ids if tag_id is not None]
+            tagged = tagged.filter(tag_id__in=tags)
+        counts.update({tag_id: 0 for tag_id in tags})
+        counts.update(tagged.values('tag_id').annotate(total=models.Count('id')).values_list('tag_id', 'total'))
+        if None in counts:
+            self.update_or_create(tag__isnull=True, defaults={'published': counts[None]})
+        self.bulk_create([self.model(tag_id=tag_id, published=published_count)
+                          for tag_id, published_count in counts.items() if tag_id is not None],
+                         update_conflicts=True, unique_fields=['tag'], update_fields=['published'])
+        return counts
+
+
+class ArticleCounter(models.Model):
+    # Number of published articles, overall (tag is null) and per tag
+    tag = models.OneToOneField(Tag,
+                               null=True,
+                               blank=True,
+                               on_delete=models.CASCADE,
+                               related_name='article_counter')
+    published = models.IntegerField(default=0)
+
+    objects = ArticleCounterManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(Coalesce('tag', Value(0)), name='blog_articlecounter_unique_tag')
+        ]
+
+    def __str__(self):
+        return f'{self.tag or "all"}: {self.published}'
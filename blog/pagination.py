@@ -0,0 +1,101 @@
+import base64
+import binascii
+import json
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    # Pages through a queryset by the values of its ordering columns instead
+    # of OFFSET, so every page is an index range scan and no COUNT is needed.
+    # All ordering fields must share one direction.
+
+    def __init__(self, queryset, per_page, ordering=('-publish', '-id')):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+        self.descending = self.ordering[0].startswith('-')
+        self.fields = [field.lstrip('-') for field in self.ordering]
+
+    def encode_cursor(self, obj, reverse=False):
+        values = [getattr(obj, field) for field in self.fields]
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+        payload = json.dumps({'v': values, 'r': reverse}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            values = payload['v']
+            if len(values) != len(self.fields):
+                raise InvalidCursor(cursor)
+            model = self.queryset.model
+            values = [model._meta.get_field(field).to_python(value)
+                      for field, value in zip(self.fields, values)]
+            return values, bool(payload.get('r'))
+        except (ValueError, TypeError, KeyError, binascii.Error, ValidationError) as e:
+            raise InvalidCursor(cursor) from e
+
+    def _beyond(self, values, forward):
+        lookup = 'lt' if self.descending == forward else 'gt'
+        condition = Q()
+        for i, field in enumerate(self.fields):
+            step = Q(**{f'{field}__{lookup}': values[i]})
+            for previous_field, value in zip(self.fields[:i], values[:i]):
+                step &= Q(**{previous_field: value})
+            condition |= step
+        return condition
+
+    def _reversed_ordering(self):
+        return [field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering]
+
+    def page(self, cursor=None):
+        if not cursor:
+            items = list(self.queryset.order_by(*self.ordering)[:self.per_page + 1])
+            has_next, has_previous = len(items) > self.per_page, False
+            items = items[:self.per_page]
+        else:
+            values, reverse = self.decode_cursor(cursor)
+            if reverse:
+                items = list(self.queryset.filter(self._beyond(values, forward=False))
+                                          .order_by(*self._reversed_ordering())[:self.per_page + 1])
+                has_next, has_previous = True, len(items) > self.per_page
+                items = items[:self.per_page][::-1]
+            else:
+                items = list(self.queryset.filter(self._beyond(values, forward=True))
+                                          .order_by(*self.ordering)[:self.per_page + 1])
+                has_next, has_previous = len(items) > self.per_page, True
+                items = items[:self.per_page]
+        next_cursor = self.encode_cursor(items[-1]) if items and has_next else None
+        previous_cursor = self.encode_cursor(items[0], reverse=True) if items and has_previous else None
+        return KeysetPage(items, next_cursor, previous_cursor)
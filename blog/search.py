@@ -0,0 +1,230 @@
+import re
+from django.conf import settings
+from django.db import connection, transaction
+from taggit.models import TaggedItem
+from .models import Article
+from .caching import cached_search, SEARCH_MAX_RESULTS
+
+
+TERM_RE = re.compile(r'\w+')
+
+
+def search_terms(query):
+    return TERM_RE.findall((query or '').lower())[:10]
+
+
+class SqliteSearchBackend:
+    # FTS5 table keyed by article id; title matches weigh most, then tags
+    table = 'blog_article_fts'
+    rank = f'bm25({table}, 10.0, 1.0, 5.0)'
+
+    def create(self, cursor, table=None):
+        cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {table or self.table} "
+                       f"USING fts5(title, body, tags, tokenize='unicode61 remove_diacritics 2')")
+
+    def drop(self, cursor, table=None):
+        cursor.execute(f'DROP TABLE IF EXISTS {table or self.table}')
+
+    def replace(self, cursor, table):
+        self.drop(cursor)
+        cursor.execute(f'ALTER TABLE {table} RENAME TO {self.table}')
+
+    def match(self, terms):
+        # An exact word scores on both alternatives, so it ranks above a prefix
+        return ' AND '.join(f'("{term}" OR "{term}"*)' for term in terms)
+
+    def index(self, cursor, article_id, title, body, tags, table=None):
+        table = table or self.table
+        cursor.execute(f'DELETE FROM {table} WHERE rowid = %s', [article_id])
+        cursor.execute(f'INSERT INTO {table} (rowid, title, body, tags) VALUES (%s, %s, %s, %s)',
+                       [article_id, title, body, tags])
+
+    def remove(self, cursor, article_id):
+        cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [article_id])
+
+    def search(self, cursor, terms, limit, offset):
+        cursor.execute(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s '
+                       f'ORDER BY {self.rank}, rowid DESC LIMIT %s OFFSET %s',
+                       [self.match(terms), limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+    def count(self, cursor, terms):
+        cursor.execute(f'SELECT COUNT(*) FROM {self.table} WHERE {self.table} MATCH %s',
+                       [self.match(terms)])
+        return cursor.fetchone()[0]
+
+
+class PostgresSearchBackend:
+    # tsvector column with a GIN index, weighted A (title), B (tags), C (body)
+    table = 'blog_article_search'
+
+    def create(self, cursor, table=None):
+        table = table or self.table
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {table} ('
+                       f'article_id bigint CONSTRAINT {table}_pkey PRIMARY KEY '
+                       f'REFERENCES blog_article (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+                       f'document tsvector NOT NULL)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {table}_document_idx '
+                       f'ON {table} USING GIN (document)')
+
+    def drop(self, cursor, table=None):
+        cursor.execute(f'DROP TABLE IF EXISTS {table or self.table}')
+
+    def replace(self, cursor, table):
+        # Index names are schema-wide, so they follow the table
+        self.drop(cursor)
+        cursor.execute(f'ALTER TABLE {table} RENAME TO {self.table}')
+        cursor.execute(f'ALTER INDEX {table}_pkey RENAME TO {self.table}_pkey')
+        cursor.execute(f'ALTER INDEX {table}_document_idx RENAME TO {self.table}_document_idx')
+
+    def match(self, terms):
+        return ' & '.join(f'({term} | {term}:*)' for term in terms)
+
+    def index(self, cursor, article_id, title, body, tags, table=None):
+        cursor.execute(f"INSERT INTO {table or self.table} (article_id, document) VALUES (%s, "
+                       f"setweight(to_tsvector('simple', %s), 'A') || "
+                       f"setweight(to_tsvector('simple', %s), 'B') || "
+                       f"setweight(to_tsvector('simple', %s), 'C')) "
+                       f"ON CONFLICT (article_id) DO UPDATE SET document = EXCLUDED.document",
+                       [article_id, title, tags, body])
+
+    def remove(self, cursor, article_id):
+        cursor.execute(f'DELETE FROM {self.table} WHERE article_id = %s', [article_id])
+
+    def search(self, cursor, terms, limit, offset):
+        cursor.execute(f"SELECT article_id FROM {self.table}, to_tsquery('simple', %s) query "
+                       f"WHERE document @@ query "
+                       f"ORDER BY ts_rank(document, query) DESC, article_id DESC LIMIT %s OFFSET %s",
+                       [self.match(terms), limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+    def count(self, cursor, terms):
+        cursor.execute(f"SELECT COUNT(*) FROM {self.table} WHERE document @@ to_tsquery('simple', %s)",
+                       [self.match(terms)])
+        return cursor.fetchone()[0]
+
+
+def get_backend(vendor=None):
+    vendor = vendor or connection.vendor
+    if vendor == 'sqlite':
+        return SqliteSearchBackend()
+    if vendor == 'postgresql' and 'django.contrib.postgres' in settings.INSTALLED_APPS:
+        return PostgresSearchBackend()
+    return None
+
+
+def article_tag_names(article_id):
+    return ' '.join(TaggedItem.objects.filter(content_type__app_label='blog',
+                                              content_type__model='article',
+                                              object_id=article_id)
+                                      .values_list('tag__name', flat=True))
+
+
+def index_article(article):
+    backend = get_backend()
+    if backend is None:
+        return
+    with connection.cursor() as cursor:
+        if article.is_published:
+            backend.index(cursor, article.id, article.title, article.body, article_tag_names(article.id))
+        else:
+            backend.remove(cursor, article.id)
+
+
+def index_articles(articles_with_tags):
+    # Bulk variant of index_article for callers that already know the tag names
+    backend = get_backend()
+    if backend is None:
+        return
+    with connection.cursor() as cursor:
+        for article, tag_names in articles_with_tags:
+            if article.is_published:
+                backend.index(cursor, article.id, article.title, article.body, ' '.join(tag_names))
+
+
+def remove_article(article_id):
+    backend = get_backend()
+    if backend is None:
+        return
+    with connection.cursor() as cursor:
+        backend.remove(cursor, article_id)
+
+
+def rebuild_search_index(chunk_size=2000):
+    # Built in a table of its own that then replaces the live one, so
+    # searches keep being answered while this runs
+    backend = get_backend()
+    if backend is None:
+        return 0
+    table = f'{backend.table}_rebuild'
+    total = 0
+    articles = Article.published.only('id', 'title', 'body').prefetch_related('tags')
+    with connection.cursor() as cursor:
+        backend.drop(cursor, table)
+        backend.create(cursor, table)
+        for article in articles.iterator(chunk_size=chunk_size):
+            tags = ' '.join(tag.name for tag in article.tags.all())
+            backend.index(cursor, article.id, article.title, article.body, tags, table=table)
+            total += 1
+        with transaction.atomic():
+            backend.replace(cursor, table)
+    return total
+
+
+class SearchResults:
+    # Lazy, sliceable ranked results, so Django's Paginator only fetches
+    # the IDs of the requested page.
+
+    def __init__(self, query, queryset=None):
+        self.terms = search_terms(query)
+        self.normalized_query = ' '.join(self.terms)
+        self.queryset = queryset if queryset is not None else Article.published.all()
+        self.backend = get_backend()
+        self._count = None
+
+    def unindexed_queryset(self):
+        # Databases without a full-text backend fall back to title matching
+        queryset = self.queryset
+        for term in self.terms:
+            queryset = queryset.filter(title__icontains=term)
+        return queryset
+
+    def ranked_ids(self, limit, offset=0):
+        if not self.terms:
+            return []
+        if offset + limit <= SEARCH_MAX_RESULTS:
+            return cached_search(self.normalized_query, f'{offset}:{limit}',
+                                 lambda: self._ranked_ids(limit, offset))
+        return self._ranked_ids(limit, offset)
+
+    def _ranked_ids(self, limit, offset):
+        if self.backend is None:
+            return list(self.unindexed_queryset().values_list('id', flat=True)[offset:offset + limit])
+        with connection.cursor() as cursor:
+            return self.backend.search(cursor, self.terms, limit, offset)
+
+    def count(self):
+        if self._count is None:
+            if not self.terms:
+                self._count = 0
+            else:
+                self._count = cached_search(self.normalized_query, 'count', self._total)
+        return self._count
+
+    def _total(self):
+        if self.backend is None:
+            return self.unindexed_queryset().count()
+        with connection.cursor() as cursor:
+            return self.backend.count(cursor, self.terms)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start = key.start or 0
+        stop = key.stop if key.stop is not None else self.count()
+        ids = self.ranked_ids(stop - start, start)
+        articles = self.queryset.in_bulk(ids)
+        return [articles[article_id] for article_id in ids if article_id in articles]
@@ -0,0 +1,135 @@
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.contrib.auth import get_user_model
+from .models import Article, ArticleCounter, Comment
+from .caching import bump_version, comments_namespace, drafts_namespace, ARTICLE_LIST, FEEDS, SEARCH, USERS
+from taggit.models import Tag
+from . import indexes, search
+
+
+def article_tag_ids(article):
+    return set(article.tags.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Article)
+def article_saved(sender, instance, created, **kwargs):
+    was_published = not created and instance.was_published
+    if not (instance.is_published and was_published):
+        bump_version(drafts_namespace(instance.author_id))
+    if not instance.is_published and not was_published:
+        return
+    tag_ids = article_tag_ids(instance)
+    if instance.is_published:
+        # Re-scored on every save as the publish date may have changed
+        indexes.add_tagged_article(instance, tag_ids)
+    if instance.is_published != was_published:
+        if instance.is_published:
+            ArticleCounter.objects.adjust(1, tag_ids)
+            indexes.add_related_tags(instance.id, tag_ids)
+        else:
+            ArticleCounter.objects.adjust(-1, tag_ids)
+            indexes.remove_tagged_article(instance.id, tag_ids)
+            indexes.remove_related_article(instance.id)
+    search.index_article(instance)
+    indexes.autocomplete_article(instance)
+    bump_version(ARTICLE_LIST, SEARCH, FEEDS)
+
+
+@receiver(pre_delete, sender=Article)
+def article_pre_delete(sender, instance, **kwargs):
+    # Tagged items are gone by the time post_delete is sent
+    instance._deleted_tag_ids = article_tag_ids(instance)
+
+
+@receiver(post_delete, sender=Article)
+def article_deleted(sender, instance, **kwargs):
+    if not instance.was_published:
+        bump_version(drafts_namespace(instance.author_id))
+    else:
+        ArticleCounter.objects.adjust(-1, instance._deleted_tag_ids)
+        indexes.remove_tagged_article(instance.id, instance._deleted_tag_ids)
+        indexes.remove_related_article(instance.id)
+        search.remove_article(instance.id)
+        indexes.autocomplete_remove('articles', instance.id)
+        bump_version(ARTICLE_LIST, SEARCH, FEEDS)
+
+
+@receiver(m2m_changed, sender=Article.tags.through)
+def article_tags_changed(sender, instance, action, pk_set, **kwargs):
+    if not isinstance(instance, Article):
+        return
+    if action == 'pre_clear':
+        instance._cleared_tag_ids = article_tag_ids(instance)
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not instance.was_published:
+        bump_version(drafts_namespace(instance.author_id))
+        return
+    tag_ids = instance._cleared_tag_ids if action == 'post_clear' else pk_set
+    if not tag_ids:
+        return
+    if action == 'post_add':
+        ArticleCounter.objects.adjust(1, tag_ids, total=False)
+        indexes.add_tagged_article(instance, tag_ids)
+        indexes.add_related_tags(instance.id, tag_ids)
+    else:
+        ArticleCounter.objects.adjust(-1, tag_ids, total=False)
+        indexes.remove_tagged_article(instance.id, tag_ids)
+        indexes.remove_related_tags(instance.id, tag_ids)
+    search.index_article(instance)
+    bump_version(ARTICLE_LIST, SEARCH, FEEDS)
+
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance, created, **kwargs):
+    indexes.autocomplete_tag(instance)
+    if created:
+        return
+    bump_version(ARTICLE_LIST, FEEDS)
+    tagged = Article.published.filter(tags=instance).only('id', 'title', 'body', 'status')
+    for article in tagged.iterator():
+        search.index_article(article)
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    indexes.autocomplete_remove('tags', instance.id)
+    indexes.remove_tag_index(instance.id)
+    bump_version(FEEDS)
+
+
+@receiver(post_save, sender=get_user_model())
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    indexes.autocomplete_user(instance)
+    bump_version(USERS)
+    if not kwargs.get('created'):
+        # Comment threads show the author's username
+        article_ids = Comment.objects.filter(author=instance).values_list('article_id', flat=True).distinct()
+        bump_version(*[comments_namespace(article_id) for article_id in article_ids])
+        if instance.username != getattr(instance, 'loaded_username', None):
+            # So do article lists and pages
+            bump_version(ARTICLE_LIST, FEEDS)
+
+
+@receiver(post_delete, sender=get_user_model())
+def user_deleted(sender, instance, **kwargs):
+    indexes.autocomplete_remove('users', instance.id)
+    bump_version(USERS)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        Article.objects.filter(id=instance.article_id).update(comment_count=F('comment_count') + 1)
+    bump_version(comments_namespace(instance.article_id), USERS)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    Article.objects.filter(id=instance.article_id, comment_count__gt=0)\
+                   .update(comment_count=F('comment_count') - 1)
+    bump_version(comments_namespace(instance.article_id), USERS)
@@ -1,33 +1,104 @@
+import os
+import re
+from django.conf import settings
 from django.contrib.sitemaps import Sitemap
-from .models import Article 
+from django.contrib.sitemaps.views import SitemapIndexItem
+from django.contrib.sites.models import Site
+from django.core.paginator import Paginator
+from django.db.models import Max
+from django.template.loader import render_to_string
 from django.urls import reverse
-import redis
-from django.conf import settings
+from django.utils import translation
+from account.sitemaps import UserSitemap
+from .models import Article
+from .indexes import live_view_counts
+
+
+SITEMAP_LIMIT = 5000
+PAGE_FILE = re.compile(r'sitemap-.+-\d+\.xml')
+
+
+class ViewCountPaginator(Paginator):
+    # Reads the live view counters of a whole section page in one MGET
+    def page(self, number):
+        page = super().page(number)
+        page.object_list = list(page.object_list)
+        views = live_view_counts(page.object_list)
+        for article in page.object_list:
+            article.views = views[article.id]
+        return page
 
-r = redis.Redis(
-    host=settings.REDIS_HOST,
-    port=settings.REDIS_PORT,
-    db=settings.REDIS_DB,
-)
 
 class ArticleSitemap(Sitemap):
     changefreq = 'never'
+    limit = SITEMAP_LIMIT
+
+    def __init__(self, language=None):
+        self.language = language or settings.LANGUAGE_CODE
+
+    @property
+    def paginator(self):
+        return ViewCountPaginator(self._items(), self.limit)
 
     def items(self):
-        return Article.published.all()
-    
+        return Article.published.only('id', 'slug', 'updated', 'views').order_by('pk')
+
+    def get_latest_lastmod(self):
+        return Article.published.aggregate(latest=Max('updated'))['latest']
+
     def lastmod(self, obj):
         return obj.updated
     
     def location(self, obj):
-        return reverse('blog:article_detail', args=(obj.slug, obj.id))
+        with translation.override(self.language):
+            return reverse('blog:article_detail', args=(obj.slug, obj.id))
     
     def priority(self, obj):
-        views = r.get(f'article:{obj.id}:views')
-        if views is not None:
-            if int(views) >= 300:
-                return 0.8
-            elif int(views) >= 100:
-                return 0.7
-        else:
-            return 0.5
\ No newline at end of file
+        if obj.views >= 300:
+            return 0.8
+        elif obj.views >= 100:
+            return 0.7
+        return 0.5
+
+
+def get_sitemaps():
+    # One section per model and language, each split into pages of SITEMAP_LIMIT urls
+    sitemaps = {}
+    for language, _ in settings.LANGUAGES:
+        sitemaps[f'articles-{language}'] = ArticleSitemap(language)
+        sitemaps[f'users-{language}'] = UserSitemap(language)
+    return sitemaps
+
+
+def sitemap_file(section, page):
+    return os.path.join(settings.SITEMAP_ROOT, f'sitemap-{section}-{page}.xml')
+
+
+def write_sitemaps(protocol='https'):
+    site = Site.objects.get_current()
+    os.makedirs(settings.SITEMAP_ROOT, exist_ok=True)
+    entries = []
+    paths = set()
+    for section, sitemap in get_sitemaps().items():
+        lastmod = sitemap.get_latest_lastmod()
+        for page in sitemap.paginator.page_range:
+            xml = render_to_string('sitemap.xml', {'urlset': sitemap.get_urls(page, site, protocol)})
+            path = sitemap_file(section, page)
+            # Written next to the target and renamed, so readers never see a partial file
+            with open(f'{path}.tmp', 'w', encoding='utf-8') as file:
+                file.write(xml)
+            os.replace(f'{path}.tmp', path)
+            location = reverse('sitemap_section', kwargs={'section': section})
+            if page > 1:
+                location += f'?p={page}'
+            entries.append(SitemapIndexItem(f'{protocol}://{site.domain}{location}', lastmod))
+            paths.add(path)
+    index = os.path.join(settings.SITEMAP_ROOT, 'sitemap.xml')
+    with open(f'{index}.tmp', 'w', encoding='utf-8') as file:
+        file.write(render_to_string('sitemap_index.xml', {'sitemaps': entries}))
+    os.replace(f'{index}.tmp', index)
+    # Pages a section no longer has, removed once the new index stops listing them
+    for entry in os.scandir(settings.SITEMAP_ROOT):
+        if PAGE_FILE.fullmatch(entry.name) and entry.path not in paths:
+            os.remove(entry.path)
+    return len(paths)
@@ -0,0 +1,18 @@
+from celery import shared_task
+from . import indexes
+from .sitemaps import write_sitemaps
+
+
+@shared_task
+def flush_article_views():
+    return indexes.flush_article_views()
+
+
+@shared_task
+def generate_sitemaps():
+    return write_sitemaps()
+
+
+@shared_task
+def rebuild_related_index():
+    return indexes.rebuild_related_index()
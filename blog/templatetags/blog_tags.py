@@ -1,5 +1,5 @@
 from django import template
-from ..models import Article
+from ..models import ArticleCounter
 from taggit.models import Tag
 from django.utils.safestring import mark_safe
 import markdown
@@ -9,12 +9,22 @@ register = template.Library()
 
 @register.simple_tag
 def all_articles():
-    return Article.published.count()
+    return ArticleCounter.objects.total()
 
 @register.simple_tag
 def all_tags():
     return Tag.objects.values_list('name', flat=True)
 
+@register.simple_tag(takes_context=True)
+def query_replace(context, **kwargs):
+    query = context['request'].GET.copy()
+    for key, value in kwargs.items():
+        if value:
+            query[key] = value
+        else:
+            query.pop(key, None)
+    return query.urlencode()
+
 @register.filter(name='markdown')
 def markdown_into_html(text):
     return mark_safe(markdown.markdown(text))
\ No newline at end of file
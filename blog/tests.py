@@ -1,11 +1,33 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
-from blog.models import Article, Comment
+from blog.models import Article, ArticleCounter, Comment
 from django.urls import reverse
 from django.utils.text import slugify
 from taggit.models import Tag
+from blog.tasks import flush_article_views, generate_sitemaps, rebuild_related_index
+from blog import indexes, search
+from blog.indexes import has_read
+from blog.bulk import bulk_create_articles
+from blog.sitemaps import ArticleSitemap
+from blog.caching import get_stats, reset_stats, SEARCH
 import redis
+import json
+import os
+import tempfile
+import threading
+import time
+from importlib import import_module, reload
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from io import StringIO
 from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import FileResponse
+from django.urls import clear_url_caches
+from forum.query_budget import QueryBudgetMixin, QueryCounter
+from forum import metrics
+from forum.metrics import dump_snapshot, get_registry, process_snapshot, PROCESS_KEY_PREFIX
+from forum.redis import async_client, breaker
 
 # Перед проведением тестов не забудьте поменять настройки кеширования в settings на dummycache
 
@@ -22,7 +44,17 @@ def user_create():
 def redis_create():
     return redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB)
 
-class ArticleTest(TestCase):
+def reload_urls():
+    # blog.urls picks its views from settings.ASYNC_VIEWS when imported
+    clear_url_caches()
+    reload(import_module('blog.urls'))
+    reload(import_module(settings.ROOT_URLCONF))
+
+def redis_down():
+    breaker.failures = breaker.threshold
+    breaker.opened_at = time.monotonic()
+
+class ArticleTest(QueryBudgetMixin, TestCase):
     title = 'article_test'
     slug = slugify(title)
     body = 'something...'
@@ -146,7 +178,7 @@ class ArticleTest(TestCase):
         self.assertEqual(response.status_code, 200)
         response = self.client.get(url, query)
         self.assertEqual(response.status_code, 200)
-        self.assertQuerySetEqual(response.context['results'], [article1, article2, article3])
+        self.assertQuerySetEqual(response.context['results'], [article1, article3, article2])
 
     def test_article_edit(self):
         self.user = user_create()
@@ -226,6 +258,69 @@ class ArticleTest(TestCase):
         self.assertEqual(len(response.context['comments']), 1)
         self.assertEqual(response.context['comments'][0].body, data['body'])
 
+    def test_comments_paginated_and_counted(self):
+        self.user = user_create()
+        article = article_create(author=self.user, title='music', slug=self.slug, body=self.body, status='PB')
+        comments = [comment_create(author=self.user, body=f'Comment {i}', article=article) for i in range(25)]
+        article.refresh_from_db()
+        self.assertEqual(article.comment_count, 25)
+        article.title = 'rock'
+        article.comment_count = 0
+        article.views = 0
+        Article.objects.filter(id=article.id).update(views=3)
+        article.save()
+        article.refresh_from_db()
+        self.assertEqual(article.comment_count, 25)
+        self.assertEqual(article.views, 3)
+        copy = Article.objects.get(id=article.id)
+        copy.pk = None
+        copy.save()
+        self.assertNotEqual(copy.id, article.id)
+        self.assertEqual(Article.objects.get(id=copy.id).comment_count, 25)
+        copy.delete()
+        article.views = 5
+        article.save(update_fields=['views'])
+        self.assertEqual(Article.objects.get(id=article.id).views, 5)
+        Article.objects.filter(id=article.id).update(views=3)
+        response = self.client.get(reverse('blog:article_detail', args=(article.slug, article.id)))
+        page = response.context['comments']
+        self.assertEqual(list(page), comments[:-21:-1])
+        self.assertEqual(response.context['article'].comment_count, 25)
+        url = reverse('blog:article_comments', args=(article.id, ))
+        response = self.client.get(url, {'cursor': page.next_cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['comments']), comments[4::-1])
+        self.assertFalse(response.context['comments'].has_next())
+        self.assertEqual(self.client.get(url, {'cursor': 'broken'}).status_code, 404)
+        comments[0].delete()
+        article.refresh_from_db()
+        self.assertEqual(article.comment_count, 24)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_comments_fragment_cache(self):
+        self.user = user_create()
+        article = article_create(author=self.user, title='music', slug=self.slug, body=self.body, status='PB')
+        comment_create(author=self.user, body='First comment', article=article)
+        url = reverse('blog:article_detail', args=(article.slug, article.id))
+        response = self.client.get(url)
+        self.assertIn('comments', response.context)
+        self.assertContains(response, 'First comment')
+        response = self.client.get(url)
+        self.assertNotIn('comments', response.context)
+        self.assertContains(response, 'First comment')
+        self.assertContains(response, f'data-author-id="{self.user.id}" hidden')
+        comment = comment_create(author=self.user, body='Second comment', article=article)
+        self.assertContains(self.client.get(url), 'Second comment')
+        comment.body = 'Edited comment'
+        comment.save()
+        self.assertContains(self.client.get(url), 'Edited comment')
+        self.assertNotIn('comments', self.client.get(url).context)
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertIn('comments', self.client.get(url).context)
+        comment.delete()
+        self.assertNotContains(self.client.get(url), 'Edited comment')
+
     def test_comment_create_forbidden(self):
         self.user = user_create()
         article = article_create(author=self.user, title='music', slug=self.slug, body=self.body, status='PB')
@@ -239,4 +334,630 @@ class ArticleTest(TestCase):
         url = reverse('blog:article_detail', args=(article.slug, article.id))
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
-        self.assertQuerySetEqual(response.context['comments'], [])
\ No newline at end of file
+        self.assertQuerySetEqual(response.context['comments'], [])
+
+    def test_article_body_rendered_on_save(self):
+        self.user = user_create()
+        article = article_create(author=self.user, title='music', slug=self.slug, body='# Header', status='PB')
+        self.assertEqual(article.body_html, '<h1>Header</h1>')
+        self.assertEqual(article.excerpt_html, '<h1>Header</h1>')
+        article = Article.objects.get(id=article.id)
+        article.body = '*New body*'
+        article.save()
+        article.refresh_from_db()
+        self.assertEqual(article.body_html, '<p><em>New body</em></p>')
+        response = self.client.get(reverse('blog:article_list'))
+        self.assertContains(response, '<p><em>New body</em></p>')
+
+    def test_article_list_cursor_pagination(self):
+        self.user = user_create()
+        articles = [article_create(author=self.user, title=self.title, slug=self.slug+str(i), body=self.body, status='PB')
+                    for i in range(7)]
+        articles.reverse()
+        url = reverse('blog:article_list')
+        response = self.client.get(url)
+        self.assertEqual(list(response.context['articles']), articles[:5])
+        self.assertFalse(response.context['page_obj'].has_previous())
+        next_cursor = response.context['page_obj'].next_cursor
+        response = self.client.get(url, {'cursor': next_cursor})
+        self.assertEqual(list(response.context['articles']), articles[5:])
+        self.assertFalse(response.context['page_obj'].has_next())
+        previous_cursor = response.context['page_obj'].previous_cursor
+        response = self.client.get(url, {'cursor': previous_cursor})
+        self.assertEqual(list(response.context['articles']), articles[:5])
+        response = self.client.get(url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_article_counters(self):
+        self.user = user_create()
+        music = Tag.objects.create(name='music', slug='music')
+        article = article_create(author=self.user, title='music', slug=self.slug, body=self.body, status='DF')
+        article.tags.add(music)
+        self.assertEqual(ArticleCounter.objects.total(), 0)
+        article.status = 'PB'
+        article.save()
+        self.assertEqual(ArticleCounter.objects.total(), 1)
+        self.assertEqual(ArticleCounter.objects.get(tag=music).published, 1)
+        article.tags.remove(music)
+        self.assertEqual(ArticleCounter.objects.get(tag=music).published, 0)
+        self.assertEqual(ArticleCounter.objects.total(), 1)
+        article.tags.add(music)
+        article.delete()
+        self.assertEqual(ArticleCounter.objects.total(), 0)
+        self.assertEqual(ArticleCounter.objects.get(tag=music).published, 0)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_article_list_cache(self):
+        redis = redis_create()
+        for key in redis.scan_iter('tag:*:articles'):
+            redis.delete(key)
+        self.user = user_create()
+        music = article_create(author=self.user, title='music', slug=self.slug, body=self.body, status='PB')
+        music.tags.add('music')
+        film = article_create(author=self.user, title='film', slug=self.slug+'1', body=self.body, status='PB')
+        film.tags.add('film')
+        response = self.client.get(reverse('blog:article_tagged_list', args=('music', )))
+        self.assertEqual(list(response.context['articles']), [music])
+        response = self.client.get(reverse('blog:article_tagged_list', args=('film', )))
+        self.assertEqual(list(response.context['articles']), [film])
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('blog:article_tagged_list', args=('film', )))
+        self.assertEqual(list(response.context['articles']), [film])
+        film2 = article_create(author=self.user, title='film2', slug=self.slug+'2', body=self.body, status='PB')
+        film2.tags.add('film')
+        response = self.client.get(reverse('blog:article_tagged_list', args=('film', )))
+        self.assertEqual(list(response.context['articles']), [film2, film])
+
+    def test_related_articles_index(self):
+        redis = redis_create()
+        for key in [*redis.scan_iter('article:*:related'), *redis.scan_iter('tag:*:articles')]:
+            redis.delete(key)
+        self.user = user_create()
+        article = article_create(author=self.user, title='a', slug=self.slug, body=self.body, status='PB')
+        article.tags.add('x', 'y')
+        same = article_create(author=self.user, title='b', slug=self.slug+'1', body=self.body, status='PB')
+        same.tags.add('x', 'y')
+        similar = article_create(author=self.user, title='c', slug=self.slug+'2', body=self.body, status='PB')
+        similar.tags.add('x')
+        draft = article_create(author=self.user, title='d', slug=self.slug+'3', body=self.body, status='DF')
+        draft.tags.add('x', 'y')
+        url = reverse('blog:article_detail', args=(article.slug, article.id))
+        response = self.client.get(url)
+        self.assertEqual(response.context['articles_with_same_tags'], [same, similar])
+        same.tags.remove('y')
+        response = self.client.get(url)
+        self.assertEqual(response.context['articles_with_same_tags'], [similar, same])
+        similar.status = 'DF'
+        similar.save()
+        response = self.client.get(reverse('api:article_related', args=(article.id, )))
+        self.assertEqual([item['id'] for item in response.data], [same.id])
+        redis.zadd(f'article:{draft.id}:related', {same.id: 1})
+        self.assertEqual(rebuild_related_index(), 2)
+        self.assertFalse(redis.exists(f'article:{draft.id}:related'))
+        self.assertEqual(redis.zrevrange(f'article:{article.id}:related', 0, -1, withscores=True),
+                         [(str(same.id).encode(), 1.0)])
+        size, indexes.RELATED_SIZE = indexes.RELATED_SIZE, 1
+        try:
+            closer = article_create(author=self.user, title='e', slug=self.slug+'4', body=self.body, status='PB')
+            closer.tags.add('x', 'y')
+            self.assertEqual(redis.zrange(f'article:{article.id}:related', 0, -1), [str(closer.id).encode()])
+            indexes.rebuild_related_index()
+            self.assertEqual(redis.zrange(f'article:{article.id}:related', 0, -1), [str(closer.id).encode()])
+        finally:
+            indexes.RELATED_SIZE = size
+
+    def test_related_articles_batch(self):
+        redis = redis_create()
+        for key in [*redis.scan_iter('article:*:related'), *redis.scan_iter('tag:*:articles')]:
+            redis.delete(key)
+        self.user = user_create()
+        sample, indexes.RELATED_TAG_SAMPLE = indexes.RELATED_TAG_SAMPLE, 2
+        try:
+            articles = bulk_create_articles(self.user, [{'title': f'a{i}', 'body': self.body, 'status': 'PB',
+                                                         'tags': ['x']} for i in range(5)])
+        finally:
+            indexes.RELATED_TAG_SAMPLE = sample
+        ids = [article.id for article in articles]
+
+        def related(article_id):
+            return {int(member) for member in redis.zrange(f'article:{article_id}:related', 0, -1)}
+
+        self.assertEqual(related(ids[0]), {ids[1], ids[2]})
+        self.assertEqual(related(ids[2]), {ids[0], ids[1], ids[3], ids[4]})
+        self.assertEqual(related(ids[4]), {ids[2], ids[3]})
+
+    def test_article_list_multiple_tags(self):
+        redis = redis_create()
+        for key in redis.scan_iter('tag:*:articles'):
+            redis.delete(key)
+        self.user = user_create()
+        both = article_create(author=self.user, title='a', slug=self.slug, body=self.body, status='PB')
+        both.tags.add('rock', 'jazz')
+        rock = article_create(author=self.user, title='b', slug=self.slug+'1', body=self.body, status='PB')
+        rock.tags.add('rock')
+        jazz = article_create(author=self.user, title='c', slug=self.slug+'2', body=self.body, status='PB')
+        jazz.tags.add('jazz')
+        draft = article_create(author=self.user, title='d', slug=self.slug+'3', body=self.body, status='DF')
+        draft.tags.add('rock', 'jazz')
+        url = reverse('blog:article_list')
+        response = self.client.get(url, {'tag': ['rock', 'jazz']})
+        self.assertEqual(list(response.context['articles']), [both])
+        response = self.client.get(url, {'tag': ['rock', 'jazz'], 'match': 'any'})
+        self.assertEqual(list(response.context['articles']), [jazz, rock, both])
+        response = self.client.get(reverse('blog:article_tagged_list', args=('rock', )))
+        self.assertEqual(list(response.context['articles']), [rock, both])
+        response = self.client.get(url, {'tag': ['rock', 'missing']})
+        self.assertEqual(list(response.context['articles']), [])
+        jazz.status = 'DF'
+        jazz.save()
+        rock.tags.add('jazz')
+        both.delete()
+        response = self.client.get(reverse('api:article_list'), {'tag': ['rock', 'jazz']})
+        self.assertEqual([item['id'] for item in response.data['results']], [rock.id])
+        tag_ids = list(Tag.objects.filter(name__in=['rock', 'jazz']).values_list('id', flat=True))
+        key = indexes.combine_tag_indexes(tag_ids)
+        self.assertEqual(indexes.combine_tag_indexes(tag_ids), key)
+        redis.zadd(indexes.tag_articles_key(tag_ids[0]), {999: 1})
+        redis.zadd(indexes.tag_articles_key(0), {999: 1})
+        self.assertEqual(indexes.rebuild_tag_index(), 2)
+        self.assertFalse(redis.exists(indexes.tag_articles_key(0)))
+        self.assertNotEqual(indexes.combine_tag_indexes(tag_ids), key)
+        self.assertEqual(indexes.tagged_article_ids(tag_ids), [rock.id])
+
+    def test_article_list_tag_pagination(self):
+        redis = redis_create()
+        for key in redis.scan_iter('tag:*:articles'):
+            redis.delete(key)
+        self.user = user_create()
+        articles = []
+        for i in range(7):
+            article = article_create(author=self.user, title=f'{i}', slug=f'{self.slug}{i}', body=self.body, status='PB')
+            article.tags.add('rock')
+            articles.append(article)
+        url = reverse('blog:article_tagged_list', args=('rock', ))
+        response = self.client.get(url)
+        self.assertEqual(list(response.context['articles']), articles[:1:-1])
+        next_cursor = response.context['page_obj'].next_cursor
+        response = self.client.get(url, {'cursor': next_cursor})
+        self.assertEqual(list(response.context['articles']), articles[1::-1])
+        self.assertFalse(response.context['page_obj'].has_next())
+        response = self.client.get(url, {'cursor': response.context['page_obj'].previous_cursor})
+        self.assertEqual(list(response.context['articles']), articles[:1:-1])
+        self.assertFalse(response.context['page_obj'].has_previous())
+
+    def test_jsonl_export_import(self):
+        self.user = user_create()
+        article = article_create(author=self.user, title='music', slug=self.slug, body='**loud**', status='PB')
+        article.tags.add('rock', 'jazz')
+        comment = comment_create(author=self.user, body='Nice', article=article)
+        created = Article.objects.get(id=article.id).created
+        with tempfile.TemporaryDirectory() as directory:
+            call_command('export_jsonl', output=directory, chunk_size=1, stdout=StringIO())
+            with open(os.path.join(directory, 'articles.jsonl')) as file:
+                self.assertEqual(json.loads(file.readline())['tags'], ['jazz', 'rock'])
+            get_user_model().objects.all().delete()
+            Tag.objects.all().delete()
+            checkpoint = os.path.join(directory, 'checkpoint.json')
+            call_command('import_jsonl', 'users', input=directory, checkpoint=checkpoint,
+                         skip_indexes=True, stdout=StringIO())
+            call_command('import_jsonl', input=directory, checkpoint=checkpoint, batch_size=1, stdout=StringIO())
+            with open(checkpoint) as file:
+                self.assertEqual(json.load(file), {'users': 1, 'articles': 1, 'comments': 1})
+        imported = Article.objects.get(id=article.id)
+        self.assertEqual(imported.author.username, 'test')
+        self.assertTrue(imported.author.check_password('qowieuryt'))
+        self.assertEqual(imported.body_html, '<p><strong>loud</strong></p>')
+        self.assertEqual(imported.created, created)
+        self.assertEqual(set(imported.tags.names()), {'rock', 'jazz'})
+        self.assertEqual(Comment.objects.get(id=comment.id).article, imported)
+        self.assertEqual(ArticleCounter.objects.total(), 1)
+
+    def test_jsonl_import_keeps_other_rows(self):
+        self.user = user_create()
+        article = article_create(author=self.user, title='music', slug=self.slug, body=self.body, status='PB')
+        article.tags.add('rock')
+        with tempfile.TemporaryDirectory() as directory:
+            call_command('export_jsonl', output=directory, stdout=StringIO())
+            # The same rows again are already imported
+            call_command('import_jsonl', input=directory, skip_indexes=True, stdout=StringIO())
+            self.assertEqual(Article.objects.count(), 1)
+            Article.objects.filter(id=article.id).update(title='other')
+            article.tags.clear()
+            with self.assertRaises(CommandError):
+                call_command('import_jsonl', 'articles', input=directory, skip_indexes=True, stdout=StringIO())
+        existing = Article.objects.get(id=article.id)
+        self.assertEqual(existing.title, 'other')
+        self.assertEqual(list(existing.tags.all()), [])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_jsonl_import_bumps_caches(self):
+        self.user = user_create()
+        article = article_create(author=self.user, title='Imported music', slug=self.slug, body=self.body, status='PB')
+        comment_create(author=self.user, body='Imported comment', article=article)
+        with tempfile.TemporaryDirectory() as directory:
+            call_command('export_jsonl', output=directory, stdout=StringIO())
+            Article.objects.filter(id=article.id).delete()
+            list_url = reverse('blog:article_list')
+            response = self.client.get(list_url)
+            self.assertNotContains(response, 'Imported music')
+            feed = self.client.get(reverse('blog:feed'))
+            call_command('import_jsonl', 'articles', 'comments', input=directory, skip_indexes=True, stdout=StringIO())
+        self.assertContains(self.client.get(list_url), 'Imported music')
+        response = self.client.get(reverse('blog:feed'), HTTP_IF_NONE_MATCH=feed['ETag'])
+        self.assertContains(response, 'Imported music')
+        response = self.client.get(reverse('blog:article_detail', args=(article.slug, article.id)))
+        self.assertContains(response, 'Imported comment')
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_feeds(self):
+        redis = redis_create()
+        for key in redis.scan_iter('tag:*:articles'):
+            redis.delete(key)
+        self.user = user_create()
+        music = article_create(author=self.user, title='Loud music', slug=self.slug, body=self.body, status='PB')
+        music.tags.add('music')
+        article_create(author=self.user, title='Silent film', slug=self.slug+'1', body=self.body, status='PB')
+        url = reverse('blog:feed')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Silent film')
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, 'Silent film')
+        self.assertContains(response, 'http://example.com/')
+        response = self.client.get(url, secure=True)
+        self.assertContains(response, 'https://example.com/')
+        self.assertNotContains(response, 'http://example.com/')
+        with self.settings(ALLOWED_HOSTS=['forum.example.com']):
+            response = self.client.get(url, HTTP_HOST='forum.example.com', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('blog:article_tag_feed', args=('music', )))
+        self.assertContains(response, 'Loud music')
+        self.assertNotContains(response, 'Silent film')
+        self.assertEqual(self.client.get(reverse('blog:article_tag_feed', args=('missing', ))).status_code, 404)
+        article_create(author=self.user, title='New song', slug=self.slug+'2', body=self.body, status='PB')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'New song')
+        tag_url = reverse('blog:article_tag_feed', args=('music', ))
+        redis_down()
+        try:
+            response = self.client.get(tag_url)
+        finally:
+            breaker.success()
+        self.assertContains(response, 'Loud music')
+        self.assertNotContains(response, 'New song')
+        Tag.objects.filter(slug='music').delete()
+        self.assertEqual(self.client.get(tag_url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 404)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_article_detail_conditional_get(self):
+        redis = redis_create()
+        self.user = user_create()
+        article = article_create(author=self.user, title='music', slug=self.slug, body=self.body, status='PB')
+        redis.delete(f'article:{article.id}:views')
+        url = reverse('blog:article_detail', args=(article.slug, article.id))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Accept-Language', response['Vary'])
+        # The first view is recorded in a new session
+        self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertIn('private', response['Cache-Control'])
+        response = self.client.get(url)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertIn('public', response['Cache-Control'])
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.client.logout()
+        self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(int(redis.get(f'article:{article.id}:views')), 2)
+        self.user.username = 'renamed'
+        self.user.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'renamed')
+        etag = response['ETag']
+        comment_create(author=self.user, body='New', article=article)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        draft = article_create(author=self.user, title='draft', slug=self.slug+'1', body=self.body, status='DF')
+        response = self.client.get(reverse('blog:article_detail', args=(draft.slug, draft.id)), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 404)
+        redis.delete(f'article:{article.id}:views')
+
+    def test_sitemaps(self):
+        redis = redis_create()
+        self.user = user_create()
+        popular = article_create(author=self.user, title='music', slug=self.slug, body=self.body, status='PB')
+        quiet = article_create(author=self.user, title='film', slug=self.slug+'1', body=self.body, status='PB')
+        redis.delete(f'article:{quiet.id}:views')
+        redis.set(f'article:{popular.id}:views', 350)
+        with tempfile.TemporaryDirectory() as directory, override_settings(SITEMAP_ROOT=directory):
+            response = self.client.get('/sitemap.xml')
+            self.assertContains(response, 'http://example.com/sitemap-articles-ru.xml')
+            with self.assertNumQueries(2):
+                response = self.client.get('/sitemap-articles-ru.xml')
+            self.assertContains(response, f'/ru/blog/article-detail/{popular.slug}/{popular.id}/</loc>')
+            self.assertContains(response, '<priority>0.8</priority>')
+            self.assertContains(response, '<priority>0.5</priority>')
+            self.assertEqual(self.client.get('/sitemap-missing.xml').status_code, 404)
+            self.assertEqual(generate_sitemaps(), 4)
+            self.assertTrue(os.path.exists(os.path.join(directory, 'sitemap-users-en-1.xml')))
+            response = self.client.get('/sitemap-articles-en.xml')
+            self.assertIsInstance(response, FileResponse)
+            self.assertIn(f'/en/blog/article-detail/{quiet.slug}/{quiet.id}/</loc>', b''.join(response.streaming_content).decode())
+            response = self.client.get('/sitemap.xml')
+            self.assertIn('https://example.com/sitemap-users-ru.xml', b''.join(response.streaming_content).decode())
+            limit, ArticleSitemap.limit = ArticleSitemap.limit, 1
+            try:
+                self.assertEqual(generate_sitemaps(), 6)
+            finally:
+                ArticleSitemap.limit = limit
+            self.assertTrue(os.path.exists(os.path.join(directory, 'sitemap-articles-en-2.xml')))
+            self.assertEqual(generate_sitemaps(), 4)
+            self.assertFalse(os.path.exists(os.path.join(directory, 'sitemap-articles-en-2.xml')))
+            self.assertTrue(os.path.exists(os.path.join(directory, 'sitemap-articles-en-1.xml')))
+        redis.delete(f'article:{popular.id}:views')
+
+    def test_article_views_counted_and_flushed(self):
+        redis = redis_create()
+        self.user = user_create()
+        article = article_create(author=self.user, title='music', slug=self.slug, body=self.body, status='PB')
+        redis.delete(f'article:{article.id}:views', f'user:{self.user.id}:viewed', 'article:views:dirty')
+        url = reverse('blog:article_detail', args=(article.slug, article.id))
+        response = self.client.get(url)
+        self.assertEqual(response.context['all_views'], 1)
+        response = self.client.get(url)
+        self.assertEqual(response.context['all_views'], 1)
+        self.client.login(username='test', password='qowieuryt')
+        response = self.client.get(url)
+        self.assertEqual(response.context['all_views'], 2)
+        response = self.client.get(url)
+        self.assertEqual(response.context['all_views'], 2)
+        self.assertEqual(flush_article_views(), 1)
+        article.refresh_from_db()
+        self.assertEqual(article.views, 2)
+
+    def test_article_read_state(self):
+        redis = redis_create()
+        self.user = user_create()
+        redis.delete(f'user:{self.user.id}:viewed')
+        read = article_create(author=self.user, title='music', slug=self.slug, body=self.body, status='PB')
+        unread = article_create(author=self.user, title='film', slug=self.slug+'1', body=self.body, status='PB')
+        self.client.login(username='test', password='qowieuryt')
+        self.client.get(reverse('blog:article_detail', args=(read.slug, read.id)))
+        self.assertTrue(has_read(self.user.id, read.id))
+        self.assertFalse(has_read(self.user.id, unread.id))
+        response = self.client.get(reverse('blog:article_list'))
+        self.assertEqual(response.context['read_ids'], {read.id})
+
+    def test_search_articles_body_and_tags(self):
+        self.user = user_create()
+        by_body = article_create(author=self.user, title='first', slug=self.slug, body='Guitar chords', status='PB')
+        by_tag = article_create(author=self.user, title='second', slug=self.slug+'1', body=self.body, status='PB')
+        by_tag.tags.add('guitar')
+        draft = article_create(author=self.user, title='guitar', slug=self.slug+'2', body=self.body, status='DF')
+        url = reverse('blog:article_search')
+        response = self.client.get(url, {'query': 'guitar'})
+        self.assertEqual(list(response.context['results']), [by_tag, by_body])
+        by_tag.tags.clear()
+        by_body.delete()
+        response = self.client.get(url, {'query': 'guitar'})
+        self.assertEqual(list(response.context['results']), [])
+        by_tag.tags.add('guitar')
+        for _ in range(2):
+            self.assertEqual(search.rebuild_search_index(chunk_size=1), 1)
+            response = self.client.get(url, {'query': 'guitar'})
+            self.assertEqual(list(response.context['results']), [by_tag])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_search_results_cache(self):
+        self.user = user_create()
+        article = article_create(author=self.user, title='Guitar', slug=self.slug, body=self.body, status='PB')
+        url = reverse('blog:article_search')
+        reset_stats(SEARCH)
+        response = self.client.get(url, {'query': 'Guitar!'})
+        self.assertEqual(list(response.context['results']), [article])
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'query': '  guitar '})
+        self.assertEqual(list(response.context['results']), [article])
+        self.assertEqual(get_stats(SEARCH)['hits'], 2)
+        self.assertEqual(get_stats(SEARCH)['misses'], 2)
+        self.client.get(url)
+        self.client.get(url, {'query': ''})
+        self.assertEqual(get_stats(SEARCH)['misses'], 2)
+        other = article_create(author=self.user, title='Guitar solo', slug=self.slug+'1', body=self.body, status='PB')
+        response = self.client.get(url, {'query': 'guitar'})
+        self.assertEqual(set(response.context['results']), {article, other})
+
+    def test_article_autocomplete(self):
+        redis = redis_create()
+        redis.delete('autocomplete:articles', 'autocomplete:articles:members',
+                     'autocomplete:tags', 'autocomplete:tags:members')
+        self.user = user_create()
+        article = article_create(author=self.user, title='Music theory', slug=self.slug, body=self.body, status='PB')
+        article.tags.add('musicals')
+        article_create(author=self.user, title='Music draft', slug=self.slug+'1', body=self.body, status='DF')
+        url = reverse('blog:article_autocomplete')
+        response = self.client.get(url, {'q': 'mus'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([item['id'] for item in data['articles']], [article.id])
+        self.assertEqual(data['articles'][0]['url'], article.get_absolute_url())
+        self.assertEqual([item['slug'] for item in data['tags']], ['musicals'])
+        article.title = 'Harmony'
+        article.save()
+        data = self.client.get(url, {'q': 'mus'}).json()
+        self.assertEqual(data['articles'], [])
+        data = self.client.get(url, {'q': 'harm'}).json()
+        self.assertEqual([item['title'] for item in data['articles']], ['Harmony'])
+
+    def test_query_budgets(self):
+        redis = redis_create()
+        for key in [*redis.scan_iter('article:*:related'), *redis.scan_iter('tag:*:articles')]:
+            redis.delete(key)
+        self.user = user_create()
+        users = [get_user_model().objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='pw')
+                 for i in range(4)]
+        tags = [Tag.objects.create(name=f'tag{i}', slug=f'tag{i}') for i in range(4)]
+        articles = []
+        for i in range(6):
+            article = article_create(author=self.user, title=f'{self.title}{i}', slug=f'{self.slug}-{i}', body=self.body, status='PB')
+            article.tags.add(*tags[:i % 4 + 1])
+            for user in users:
+                comment_create(user, self.body, article)
+            articles.append(article)
+        article = articles[-1]
+        for client_user in (None, self.user):
+            if client_user:
+                self.client.force_login(client_user)
+            self.assertWithinBudget(reverse('blog:article_list'))
+            self.assertWithinBudget(reverse('blog:article_list'), {'tag': ['tag0', 'tag1']})
+            self.assertWithinBudget(article.get_absolute_url())
+            self.assertWithinBudget(reverse('blog:article_comments', args=(article.id, )))
+            self.assertWithinBudget(reverse('blog:article_search'), {'query': self.title})
+        self.assertWithinBudget(reverse('blog:article_comment', args=(article.id, )), {'body': 'budget'}, method='post')
+        for count in (1, 4):
+            self.assertWithinBudget(reverse('blog:article_create'), method='post',
+                                    data={'title': f'new {count}', 'body': self.body, 'status': 'PB',
+                                          'tags': [tag.id for tag in tags[:count]]})
+        self.assertWithinBudget(reverse('blog:article_edit', args=(article.id, )), method='post',
+                                data={'title': 'edited', 'body': self.body, 'status': 'PB',
+                                      'tags': [tag.id for tag in tags]})
+
+    def test_metrics(self):
+        redis = redis_create()
+        self.user = user_create()
+        article_create(author=self.user, title=self.title, slug=self.slug, body=self.body, status='PB')
+        self.client.get(reverse('blog:article_list'))
+        other = {'counters': {('forum_http_requests_total', (('route', 'other:view'), ('method', 'GET'), ('status', 200))): 3},
+                 'histograms': {}}
+        redis.set(f'{PROCESS_KEY_PREFIX}otherhost:1', dump_snapshot(other))
+        try:
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+            with override_settings(DEBUG=True):
+                response = self.client.get(reverse('metrics'))
+        finally:
+            redis.delete(f'{PROCESS_KEY_PREFIX}otherhost:1')
+        self.assertEqual(response.status_code, 200)
+        lines = response.content.decode().splitlines()
+        self.assertIn('forum_http_requests_total{route="other:view",method="GET",status="200"} 3', lines)
+        route = 'route="blog:article_list"'
+        self.assertTrue(any(line.startswith(f'forum_http_requests_total{{{route},method="GET",status="200"}} ')
+                            for line in lines))
+        self.assertTrue(any(line.startswith(f'forum_http_request_duration_seconds_bucket{{{route},le="+Inf"}} ')
+                            for line in lines))
+        self.assertTrue(any(line.startswith(f'forum_template_render_seconds_count{{{route}}} ') for line in lines))
+        self.assertTrue(any(line.startswith(f'forum_db_queries_total{{{route}}} ') for line in lines))
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secreT')
+            self.assertEqual(response.status_code, 403)
+        # Requests are counted without keeping their SQL
+        with QueryCounter() as counter:
+            Article.objects.count()
+        self.assertEqual(counter.queries, 1)
+        self.assertIsNone(counter.statements)
+
+    def test_metrics_of_exited_threads(self):
+        labels = (('route', 'thread:view'), )
+
+        def work():
+            get_registry().inc('forum_http_requests_total', labels, 2)
+
+        threads = [threading.Thread(target=work) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        self.assertEqual(process_snapshot()['counters'][('forum_http_requests_total', labels)], 6)
+        self.assertFalse(any(thread in metrics._registries for thread in threads))
+        get_registry()
+        self.assertIn(threading.current_thread(), metrics._registries)
+
+    def test_redis_unavailable(self):
+        self.user = user_create()
+        article = article_create(author=self.user, title='music', slug=self.slug, body=self.body, status='PB')
+        Article.objects.filter(id=article.id).update(views=7)
+        self.client.login(username='test', password='qowieuryt')
+        redis_down()
+        try:
+            response = self.client.get(reverse('blog:article_detail', args=(article.slug, article.id)))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['all_views'], 7)
+            self.assertEqual(list(response.context['articles_with_same_tags']), [])
+            response = self.client.get(reverse('blog:article_list'))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['read_ids'], set())
+            # Index writes are skipped, the database changes go through
+            draft = article_create(author=self.user, title='film', slug=self.slug+'1', body=self.body, status='DF')
+            draft.status = 'PB'
+            draft.save()
+            draft.tags.add('cinema')
+            self.user.first_name = 'Name'
+            self.user.save()
+            with self.captureOnCommitCallbacks(execute=True):
+                articles = bulk_create_articles(self.user, [{'title': 'bulk', 'body': self.body, 'status': 'PB',
+                                                             'tags': ['new']}])
+        finally:
+            breaker.success()
+        self.assertEqual(list(Article.objects.get(id=draft.id).tags.names()), ['cinema'])
+        self.assertTrue(Article.published.filter(id=articles[0].id).exists())
+        self.assertTrue(Tag.objects.filter(name='new').exists())
+
+    def test_async_client_closed_with_its_loop(self):
+        async def use():
+            client = async_client()
+            self.assertIs(client.cached_script('return 1'), client.cached_script('return 1'))
+            self.assertEqual(await client.cached_script('return 1')(), 1)
+            return client
+
+        client = async_to_sync(use)()
+        connections = client.connection_pool._available_connections
+        self.assertTrue(connections)
+        self.assertFalse(any(connection.is_connected for connection in connections))
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_async_article_detail_and_comment(self):
+        redis = redis_create()
+        self.user = user_create()
+        article = article_create(author=self.user, title='music', slug=self.slug, body=self.body, status='PB')
+        article.tags.add('music')
+        related = article_create(author=self.user, title='song', slug=self.slug+'1', body=self.body, status='PB')
+        related.tags.add('music')
+        draft = article_create(author=self.user, title='film', slug=self.slug+'2', body=self.body, status='DF')
+        redis.delete(f'article:{article.id}:views', f'user:{self.user.id}:viewed', 'article:views:dirty')
+        try:
+            with override_settings(ASYNC_VIEWS=True):
+                reload_urls()
+                url = reverse('blog:article_detail', args=(article.slug, article.id))
+                response = self.assertWithinBudget(url)
+                self.assertTrue(iscoroutinefunction(response.resolver_match.func))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.context['all_views'], 1)
+                self.assertEqual(response.context['articles_with_same_tags'], [related])
+                self.assertContains(response, 'music')
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(self.client.get(reverse('blog:article_detail', args=(draft.slug, draft.id))).status_code, 404)
+
+                comment_url = reverse('blog:article_comment', args=(article.id, ))
+                response = self.client.post(comment_url, {'body': 'comment'})
+                self.assertRedirects(response, f'{reverse("account:login")}?next={comment_url}',
+                                     fetch_redirect_response=False)
+                self.client.login(username='test', password='qowieuryt')
+                self.assertEqual(self.client.get(comment_url).status_code, 405)
+                response = self.assertWithinBudget(comment_url, {'body': 'comment'}, method='post')
+                self.assertRedirects(response, url, fetch_redirect_response=False)
+                self.assertEqual(Comment.objects.filter(article=article, author=self.user).count(), 1)
+                response = self.assertWithinBudget(url)
+                self.assertEqual(response.context['all_views'], 2)
+                self.assertContains(response, 'comment')
+        finally:
+            reload_urls()
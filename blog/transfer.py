@@ -0,0 +1,139 @@
+import datetime
+import json
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from taggit.models import TaggedItem
+from .models import Article, Comment, render_article_body
+from .bulk import get_or_create_tags
+from .caching import bump_version, comments_namespace, drafts_namespace, ARTICLE_LIST, FEEDS, SEARCH, USERS
+
+
+# JSONL dumps of forum content: one file per kind, one object per line with
+# the model's concrete columns (articles also carry their tag names).
+# Kinds are listed in dependency order, which is also the import order.
+
+KINDS = ('users', 'articles', 'comments')
+
+
+class DumpEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder rounds datetimes to milliseconds
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def get_model(kind):
+    return {'users': get_user_model(), 'articles': Article, 'comments': Comment}[kind]
+
+
+def dump_fields(model):
+    skipped = {'body_html', 'excerpt_html'} if model is Article else set()
+    return [field.attname for field in model._meta.concrete_fields if field.attname not in skipped]
+
+
+def tag_names(article_ids):
+    names = {article_id: [] for article_id in article_ids}
+    tagged = TaggedItem.objects.filter(content_type__app_label='blog',
+                                       content_type__model='article',
+                                       object_id__in=article_ids)
+    for article_id, name in tagged.order_by('tag__name').values_list('object_id', 'tag__name'):
+        names[article_id].append(name)
+    return names
+
+
+def export_lines(kind, chunk_size=2000):
+    # Keyset iteration by pk keeps memory flat however large the table is
+    model = get_model(kind)
+    fields = dump_fields(model)
+    queryset = model._default_manager.order_by('pk').values(*fields)
+    last_pk = None
+    while True:
+        chunk = queryset.filter(pk__gt=last_pk) if last_pk is not None else queryset
+        rows = list(chunk[:chunk_size])
+        if not rows:
+            return
+        last_pk = rows[-1]['id']
+        if kind == 'articles':
+            names = tag_names([row['id'] for row in rows])
+            for row in rows:
+                row['tags'] = names[row['id']]
+        for row in rows:
+            yield json.dumps(row, cls=DumpEncoder, ensure_ascii=False) + '\n'
+
+
+def parse_lines(task):
+    # Runs in worker processes: no database access here
+    kind, lines = task
+    rows = [json.loads(line) for line in lines if line.strip()]
+    if kind == 'articles':
+        for row in rows:
+            row['body_html'], row['excerpt_html'] = render_article_body(row['body'])
+    return len(lines), rows
+
+
+def auto_now_fields(model):
+    return [field.attname for field in model._meta.concrete_fields
+            if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)]
+
+
+class ImportConflict(Exception):
+    pass
+
+
+def same_row(model, stored, row):
+    return all(model._meta.get_field(name).to_python(row[name]) == value for name, value in stored.items())
+
+
+def cache_namespaces(kind, rows):
+    # The cached pages imported rows show up in
+    if kind == 'users':
+        return {USERS}
+    if kind == 'articles':
+        return {ARTICLE_LIST, SEARCH, FEEDS, *(drafts_namespace(row['author_id']) for row in rows)}
+    return {USERS, *(comments_namespace(row['article_id']) for row in rows)}
+
+
+def import_rows(kind, rows):
+    model = get_model(kind)
+    tags = [row.pop('tags', []) for row in rows]
+    fields = dump_fields(model)
+    restored = auto_now_fields(model)
+    with transaction.atomic():
+        stored = {row['id']: row for row in model._default_manager.filter(pk__in=[row['id'] for row in rows])
+                                                                   .values(*fields)}
+        # Rows already present from an interrupted run are skipped, other
+        # rows holding the same primary key are never touched
+        conflicts = [row['id'] for row in rows if row['id'] in stored and not same_row(model, stored[row['id']], row)]
+        if conflicts:
+            raise ImportConflict(f'{kind} {", ".join(map(str, conflicts))} already exist with other contents')
+        new = [i for i, row in enumerate(rows) if row['id'] not in stored]
+        rows, tags = [rows[i] for i in new], [tags[i] for i in new]
+        objs = [model(**row) for row in rows]
+        model._default_manager.bulk_create(objs)
+        if restored and objs:
+            # bulk_create stamps auto_now fields with the current time
+            for obj, row in zip(objs, rows):
+                for field in restored:
+                    setattr(obj, field, row[field])
+            model._default_manager.bulk_update(objs, restored)
+        if kind == 'articles':
+            by_name = get_or_create_tags(name for names in tags for name in names)
+            content_type = ContentType.objects.get_for_model(Article)
+            TaggedItem.objects.bulk_create([TaggedItem(content_type=content_type, object_id=obj.pk, tag=by_name[name])
+                                            for obj, names in zip(objs, tags) for name in set(names)],
+                                           ignore_conflicts=True)
+    if objs:
+        bump_version(*cache_namespaces(kind, rows))
+    return len(objs)
+
+
+def reset_sequences():
+    # Imported rows keep their primary keys, so sequences must move past them
+    statements = connection.ops.sequence_reset_sql(no_style(), [get_model(kind) for kind in KINDS])
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
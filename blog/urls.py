@@ -1,16 +1,26 @@
+from django.conf import settings
 from django.urls import path
 from . import views
-from .feeds import LatestArticlesFeed
+from . import async_views
+from . import feeds
 
 app_name = 'blog'
 
+if settings.ASYNC_VIEWS:
+    article_detail, comment_create = async_views.article_detail, async_views.comment_create
+else:
+    article_detail, comment_create = views.ArticleDetailView.as_view(), views.comment_create
+
 urlpatterns = [
     path('', views.ArticleListView.as_view(), name='article_list'),
     path('tag/<slug:tag>/', views.ArticleListView.as_view(), name='article_tagged_list'),
-    path('article-detail/<slug:slug>/<int:id>/', views.ArticleDetailView.as_view(), name='article_detail'),
-    path('article-comment/<int:id>/', views.comment_create, name='article_comment'),
-    # path('feed/', LatestArticlesFeed(), name='feed'),
+    path('tag/<slug:tag>/feed/', feeds.tag_articles_feed, name='article_tag_feed'),
+    path('article-detail/<slug:slug>/<int:id>/', article_detail, name='article_detail'),
+    path('article-comment/<int:id>/', comment_create, name='article_comment'),
+    path('article-comments/<int:id>/', views.article_comments, name='article_comments'),
+    path('feed/', feeds.latest_articles_feed, name='feed'),
     path('search/', views.ArticleSearchView.as_view(), name='article_search'),
+    path('search/autocomplete/', views.article_autocomplete, name='article_autocomplete'),
     path('article/create/', views.ArticleCreateView.as_view(), name='article_create'),
     path('article/edit/<int:pk>/', views.ArticleEditView.as_view(), name='article_edit'),
     path('article/delete/<int:pk>/', views.ArticleDeleteView.as_view(), name='article_delete'),
@@ -1,58 +1,146 @@
 from django.shortcuts import redirect, render, get_object_or_404
-from django.urls import reverse_lazy
+from django.template.loader import render_to_string
+from django.urls import reverse, reverse_lazy
 from django.views.generic import ListView, DetailView, UpdateView, FormView, CreateView, DeleteView
-from .models import Article, Comment
+from .models import Article, ArticleCounter, Comment
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from .forms import CommentForm, SearchForm, TagSelectionForm
 from django.views.decorators.http import require_POST
 from django.contrib.auth.decorators import login_required
-from django.db.models import Count
-from django.contrib.postgres.search import TrigramSimilarity
 from django.utils.text import slugify
-from django.http import Http404
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.contrib.sitemaps import views as sitemap_views
+from django.core.paginator import Paginator
+from .pagination import KeysetPage, KeysetPaginator, InvalidCursor
+from .caching import article_list_key, cache_get, comments_key, comments_namespace, get_version, version_datetime, \
+                     ARTICLE_LIST, ARTICLE_LIST_TIMEOUT, COMMENTS_TIMEOUT
+from forum.conditional import ConditionalGetMixin
+from forum.query_budget import query_budget
+from .indexes import autocomplete, count_view, read_article_ids, related_articles, \
+                     TaggedArticlePaginator, TAGGED_MATCHES
+from .search import SearchResults
+from .bulk import add_tags
+from .sitemaps import get_sitemaps, sitemap_file
 from taggit.models import Tag
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
 from unidecode import unidecode
 from django.contrib import messages
 from django.core.cache import cache
-import redis
-
-
-r = redis.Redis(
-    host=settings.REDIS_HOST,
-    port=settings.REDIS_PORT,
-    db=settings.REDIS_DB,
-)
+import os
 
 
+@query_budget(queries=7, redis=3)
 class ArticleListView(ListView):
     model = Article
     paginate_by = 5
     template_name = 'blog/article/list.html'
     context_object_name = 'articles'
+    cursor_kwarg = 'cursor'
+
+    def get_tags(self):
+        tags = [tag for tag in self.request.GET.getlist('tag') if tag]
+        if self.kwargs.get('tag'):
+            tags.append(self.kwargs['tag'])
+        return sorted(set(tags))
+
+    def get_match(self):
+        match = self.request.GET.get('match')
+        return match if match in TAGGED_MATCHES else TAGGED_MATCHES[0]
+
+    def get_paginator(self, queryset, per_page, **kwargs):
+        tags = self.get_tags()
+        if not tags:
+            return KeysetPaginator(queryset, per_page, ordering=('-publish', '-id'))
+        tag_ids = list(Tag.objects.filter(slug__in=tags).values_list('id', flat=True))
+        if self.get_match() == 'all' and len(tag_ids) < len(tags):
+            tag_ids = []
+        return TaggedArticlePaginator(queryset, per_page, tag_ids, self.get_match())
 
     def get_queryset(self):
-        queryset = cache.get('queryset')
-        if not queryset:
-            queryset = Article.published.all().select_related('author').prefetch_related('tags')
-            tag_get_arg = self.request.GET.get('tag')
-            tag_kwarg = self.kwargs.get('tag')
-            if tag_get_arg:
-                queryset = queryset.filter(tags__slug=tag_get_arg)
-            elif tag_kwarg:
-                queryset = queryset.filter(tags__slug=tag_kwarg)
-                cache.set('queryset', queryset)
-        return queryset
+        return Article.published.defer('body', 'body_html')\
+                                .select_related('author').prefetch_related('tags')
+
+    def paginate_queryset(self, queryset, page_size):
+        cursor = self.request.GET.get(self.cursor_kwarg)
+        cache_key = article_list_key(self.get_tags(), self.get_match(), cursor)
+        cached = cache_get(cache_key)
+        if cached is not None:
+            articles = queryset.in_bulk(cached['ids'])
+            page = KeysetPage([articles[id] for id in cached['ids'] if id in articles],
+                              cached['next'], cached['previous'])
+            return None, page, page.object_list, page.has_other_pages()
+        paginator = self.get_paginator(queryset, page_size)
+        try:
+            page = paginator.page(cursor)
+        except InvalidCursor:
+            raise Http404(_('Invalid page.'))
+        cache.set(cache_key, {'ids': [article.id for article in page],
+                              'next': page.next_cursor,
+                              'previous': page.previous_cursor}, ARTICLE_LIST_TIMEOUT)
+        return paginator, page, page.object_list, page.has_other_pages()
         
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['all_articles'] = Article.published.count()
-        context['all_tags'] = Tag.objects.all()
+        context['all_articles'] = ArticleCounter.objects.total()
+        context['all_tags'] = Tag.objects.select_related('article_counter')
+        context['selected_tags'] = self.get_tags()
+        context['match'] = self.get_match()
+        if self.request.user.is_authenticated:
+            context['read_ids'] = read_article_ids(self.request.user.id,
+                                                   [article.id for article in context['articles']])
         return context
 
 
-class ArticleDetailView(DetailView):
+COMMENTS_PER_PAGE = 20
+
+
+def comments_page(article, cursor=None):
+    queryset = Comment.objects.filter(article=article).select_related('author')
+    paginator = KeysetPaginator(queryset, COMMENTS_PER_PAGE, ordering=('-created', '-id'))
+    try:
+        return paginator.page(cursor)
+    except InvalidCursor:
+        raise Http404(_('Invalid page.'))
+
+
+def render_comments(article, cursor=None):
+    # The rendered block is shared by all visitors; delete links are shown
+    # client-side by data-author-id. Returns the page only on a cache miss.
+    cache_key = comments_key(article.id, cursor)
+    html = cache_get(cache_key)
+    if html is not None:
+        return None, html
+    comments = comments_page(article, cursor)
+    html = render_to_string('blog/article/comments.html', {'article': article, 'comments': comments})
+    cache.set(cache_key, html, COMMENTS_TIMEOUT)
+    return comments, html
+
+
+def article_validators(article):
+    comments_version = get_version(comments_namespace(article.id))
+    # The page also shows the author's username
+    author = article.author
+    return ((article.id, article.updated, article.comment_count, comments_version, get_version(ARTICLE_LIST),
+             author.username),
+            max(article.updated, author.user_updated, version_datetime(comments_namespace(article.id)),
+                version_datetime(ARTICLE_LIST)))
+
+
+def count_view_kwargs(request, article):
+    # Signed in readers are deduplicated by Redis, anonymous ones by session
+    if request.user.is_authenticated:
+        return {'user_id': request.user.id}
+    session_key = f'viewed_article_{article.id}'
+    count = not request.session.get(session_key, False)
+    if count:
+        # Only the first view writes the session, later ones stay cacheable
+        request.session[session_key] = True
+    return {'count': count}
+
+
+@query_budget(queries=9, redis=2)
+class ArticleDetailView(ConditionalGetMixin, DetailView):
     model = Article
     template_name = 'blog/article/article_detail.html'
     context_object_name = 'article'
@@ -61,38 +149,36 @@ class ArticleDetailView(DetailView):
         queryset = Article.objects.all().select_related('author')
         return queryset
 
+    def get_validators(self, request, *args, **kwargs):
+        article = Article.objects.filter(id=kwargs['id'], slug=kwargs['slug']).select_related('author')\
+                                 .only('id', 'status', 'author_id', 'updated', 'views', 'comment_count',
+                                       'author__username', 'author__user_updated').first()
+        if article is None or (not article.is_published and article.author_id != request.user.pk):
+            return None
+        self.meta = article
+        return article_validators(article)
+
+    def not_modified(self, request, *args, **kwargs):
+        self.count_view(self.meta)
+
+    def count_view(self, article):
+        return count_view(article, **count_view_kwargs(self.request, article))
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         if context['article'].status == Article.Status.DRAFT and self.request.user != context['article'].author:
             raise Http404
-        articles_with_same_tags = cache.get(f'article:{context['article'].id}:same_articles')
-        if not articles_with_same_tags:
-            tags_ids = context['article'].tags.values_list('id', flat=True)
-            articles_with_same_tags = Article.published.filter(tags__in=tags_ids).exclude(id=context['article'].id)
-            articles_with_same_tags = articles_with_same_tags.annotate(same_tags=Count('tags'))\
-                                                        .order_by('-same_tags', '-publish')[:5]
-            cache.set(f'article:{context['article'].id}:same_articles', articles_with_same_tags)
-        context['comments'] = Comment.objects.filter(article=context['article']).prefetch_related('author')
-        context['articles_with_same_tags'] = articles_with_same_tags
+        comments, context['comments_html'] = render_comments(context['article'])
+        if comments is not None:
+            context['comments'] = comments
+        context['articles_with_same_tags'] = related_articles(context['article'].id)
         context['form'] = CommentForm
-        article_id = context['article'].id
-        user_id = self.request.user.id if self.request.user.is_authenticated else None
-        if user_id:
-            user_key = f'user:{user_id}:viewed_articles'
-            if not r.sismember(user_key, article_id):
-                r.incr(f'article:{article_id}:views')
-                r.sadd(user_key, article_id)
-        else:
-            session_key = f'viewed_article_{article_id}'
-            if not self.request.session.get(session_key, False):
-                r.incr(f'article:{article_id}:views')
-                self.request.session[session_key] = True
-        views = r.get(f'article:{article_id}:views')
-        context['all_views'] = int(views)
+        context['all_views'] = self.count_view(context['article'])
         return context
 
 @login_required
 @require_POST
+@query_budget(queries=5, redis=0)
 def comment_create(request, id):
     article = get_object_or_404(Article,
                              id=id,
@@ -107,25 +193,67 @@ def comment_create(request, id):
     return redirect(reverse_lazy('blog:article_detail', args=(article.slug, article.id)))
 
 
+@query_budget(queries=2, redis=0)
+def article_comments(request, id):
+    article = get_object_or_404(Article.published.only('id'), id=id)
+    comments, html = render_comments(article, request.GET.get('cursor'))
+    return HttpResponse(html)
+
+
+@query_budget(queries=5, redis=0)
 class ArticleSearchView(FormView):
     template_name = 'blog/article/search.html'
     form_class = SearchForm
+    paginate_by = 10
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         query = self.request.GET.get('query')
-        results = cache.get(query)
-        if not results:
-            if query:
-                results = Article.published.filter(title__icontains=query)
-            else:
-                results = []
-            cache.set(query, results)
-        context['results'] = results
+        results = SearchResults(query, Article.published.defer('body', 'body_html'))
+        page = Paginator(results, self.paginate_by).get_page(self.request.GET.get('page'))
+        context['results'] = page
+        context['page_obj'] = page
         context['query'] = query
         return context
     
 
+def article_autocomplete(request):
+    prefix = request.GET.get('q', '').strip()[:50]
+    suggestions = autocomplete(prefix) if prefix else {'articles': [], 'tags': [], 'users': []}
+    for article in suggestions['articles']:
+        article['url'] = reverse('blog:article_detail', args=(article['slug'], article['id']))
+    for tag in suggestions['tags']:
+        tag['url'] = reverse('blog:article_tagged_list', args=(tag['slug'], ))
+    for user in suggestions['users']:
+        user['url'] = reverse('account:user_detail', args=(user['id'], ))
+    return JsonResponse(suggestions)
+
+
+# Sitemaps are served from the files written by the write_sitemaps task and
+# only rendered on the fly until those exist.
+
+def sitemap_index(request):
+    path = os.path.join(settings.SITEMAP_ROOT, 'sitemap.xml')
+    if os.path.exists(path):
+        return FileResponse(open(path, 'rb'), content_type='application/xml')
+    return sitemap_views.index(request, get_sitemaps(), sitemap_url_name='sitemap_section')
+
+
+def sitemap_section(request, section):
+    sitemaps = get_sitemaps()
+    if section not in sitemaps:
+        raise Http404
+    try:
+        page = int(request.GET.get('p', 1))
+    except ValueError:
+        raise Http404
+    path = sitemap_file(section, page)
+    if os.path.exists(path):
+        return FileResponse(open(path, 'rb'), content_type='application/xml')
+    return sitemap_views.sitemap(request, sitemaps, section=section)
+
+
+@query_budget(queries=18, redis=8)
 class ArticleCreateView(LoginRequiredMixin, CreateView):
     model = Article
     fields = ['title', 'body', 'status']
@@ -144,9 +272,7 @@ class ArticleCreateView(LoginRequiredMixin, CreateView):
         tags = self.request.POST.getlist('tags') 
         if tags:
             response = super().form_valid(form)
-            for id in tags:
-                tag = Tag.objects.get(id=id)
-                form.instance.tags.add(tag)
+            add_tags(form.instance, tags)
             if form.instance.status == 'PB':
                 messages.success(self.request, _('Your article has been successfully created.\
                                                  It will be shown in the list of articles within 15 minutes '))
@@ -162,6 +288,7 @@ class ArticleCreateView(LoginRequiredMixin, CreateView):
         return super().form_invalid(form)
 
 
+@query_budget(queries=15, redis=6)
 class ArticleEditView(UserPassesTestMixin, UpdateView):
     model = Article
     fields = ['title', 'body', 'status']
@@ -170,6 +297,12 @@ class ArticleEditView(UserPassesTestMixin, UpdateView):
     def test_func(self):
         article = self.get_object()
         return self.request.user == article.author
+
+    def get_object(self, queryset=None):
+        # Already fetched by test_func
+        if getattr(self, 'object', None) is None:
+            self.object = super().get_object(queryset)
+        return self.object
     
     def handle_no_permission(self):
         raise Http404
@@ -184,12 +317,7 @@ class ArticleEditView(UserPassesTestMixin, UpdateView):
     def form_valid(self, form):
         tags = self.request.POST.getlist('tags')
         if tags:
-            for id in tags:
-                try:
-                    tag = Tag.objects.get(id=id)
-                    form.instance.tags.add(tag)
-                except Tag.DoesNotExist:
-                    pass
+            add_tags(form.instance, tags)
             if form.instance.status == 'PB':
                 messages.success(self.request, _('Your article has been updated.\
                                 You will see changes within 15 minutes.'))
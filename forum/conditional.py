@@ -0,0 +1,74 @@
+import hashlib
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.utils.translation import get_language
+
+
+# Conditional GET for class based views, Django's and DRF's alike. Views
+# describe their content with cheap metadata (timestamps, counts, cache
+# versions) and a matching If-None-Match/If-Modified-Since is answered with
+# 304 before the page is rendered or the object serialized.
+
+def make_etag(*parts):
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def patch_validation_headers(request, response):
+    # Pages vary by the language prefix and by who is looking at them
+    patch_vary_headers(response, ('Accept-Language', 'Cookie', 'Authorization'))
+    # A response that sets a cookie, the session's included, must not be
+    # shared with other visitors either
+    session = getattr(request, 'session', None)
+    if request.user.is_authenticated or response.cookies or (session is not None and session.modified):
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, public=True, no_cache=True)
+
+
+def check_validators(request, validators):
+    # Returns the ETag, the Last-Modified timestamp and, when the client's
+    # copy is still fresh, the 304 response
+    parts, last_modified = validators
+    etag = make_etag(get_language(), request.user.pk, *parts)
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return etag, timestamp, get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+
+def set_validators(response, etag, timestamp):
+    response.headers.setdefault('ETag', etag)
+    if timestamp is not None:
+        response.headers.setdefault('Last-Modified', http_date(timestamp))
+
+
+def has_pending_messages(request):
+    # Pending flash messages would stay unread behind a 304
+    return bool(len(getattr(request, '_messages', ())))
+
+
+class ConditionalGetMixin:
+    def get_validators(self, request, *args, **kwargs):
+        # Returns (parts of the ETag, last modified datetime), or None to
+        # render unconditionally (e.g. when the object does not exist)
+        return None
+
+    def not_modified(self, request, *args, **kwargs):
+        # Side effects the full page would have had, run for 304s too
+        pass
+
+    def get(self, request, *args, **kwargs):
+        validators = None
+        if not has_pending_messages(request):
+            validators = self.get_validators(request, *args, **kwargs)
+        if validators is None:
+            response = super().get(request, *args, **kwargs)
+            patch_validation_headers(request, response)
+            return response
+        etag, timestamp, response = check_validators(request, validators)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        else:
+            self.not_modified(request, *args, **kwargs)
+        set_validators(response, etag, timestamp)
+        patch_validation_headers(request, response)
+        return response
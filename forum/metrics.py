@@ -0,0 +1,279 @@
+import hmac
+import json
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed, PermissionDenied
+from django.http import HttpResponse
+import redis
+from .query_budget import QueryCounter
+
+
+# Request metrics in the Prometheus text format. Each thread records into
+# a registry of its own, so requests never take a lock. /metrics merges
+# the registries of the process answering it with the snapshots the other
+# worker processes push to Redis every METRICS_PUSH_INTERVAL seconds from a
+# background thread.
+# Latencies and sizes are histograms, which unlike percentiles can be
+# summed across processes; histogram_quantile() derives the percentiles.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (512, 2048, 8192, 32768, 131072, 524288, 2097152)
+
+METRICS = {
+    'forum_http_requests_total': ('counter', 'Requests answered, by route, method and status'),
+    'forum_http_request_duration_seconds': ('histogram', 'Time to answer a request', LATENCY_BUCKETS),
+    'forum_http_response_size_bytes': ('histogram', 'Size of non-streaming response bodies', SIZE_BUCKETS),
+    'forum_template_render_seconds': ('histogram', 'Time to render template responses', LATENCY_BUCKETS),
+    'forum_db_queries_total': ('counter', 'SQL queries'),
+    'forum_db_query_seconds_total': ('counter', 'Time spent in SQL queries'),
+    'forum_redis_round_trips_total': ('counter', 'Redis round trips, a pipeline counting once'),
+    'forum_redis_seconds_total': ('counter', 'Time spent waiting for Redis'),
+    'forum_redis_command_seconds': ('histogram', 'Time per Redis command, by command', LATENCY_BUCKETS),
+    'forum_cache_hits_total': ('counter', 'Cache lookups that found an entry'),
+    'forum_cache_misses_total': ('counter', 'Cache lookups that found nothing'),
+}
+
+PROCESS_KEY_PREFIX = 'metrics:process:'
+
+
+class Registry:
+    def __init__(self):
+        # (name, labels) -> value
+        self.counters = {}
+        # (name, labels) -> [count per bucket, count above the last bucket, sum]
+        self.histograms = {}
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        buckets = METRICS[name][2]
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = [0] * (len(buckets) + 2)
+        histogram[bisect_left(buckets, value)] += 1
+        histogram[-1] += value
+
+    def add(self, other):
+        for key, value in other.counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, values in other.histograms.items():
+            merged = self.histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                merged[i] += value
+
+
+_local = threading.local()
+# thread -> its registry, while the thread lives
+_registries = {}
+# What threads that have since exited recorded
+_retired = Registry()
+_registries_lock = threading.Lock()
+_pusher_pid = None
+
+
+def retire_dead_registries():
+    # Servers that start a thread per request would otherwise keep one
+    # registry per request ever served. Called with _registries_lock held.
+    for thread in [thread for thread in _registries if not thread.is_alive()]:
+        _retired.add(_registries.pop(thread))
+
+
+def get_registry():
+    registry = getattr(_local, 'registry', None)
+    if registry is None:
+        registry = _local.registry = Registry()
+        with _registries_lock:
+            retire_dead_registries()
+            _registries[threading.current_thread()] = registry
+    return registry
+
+
+def process_snapshot():
+    # Other threads may be writing meanwhile; dict.copy() is atomic
+    counters, histograms = {}, {}
+    with _registries_lock:
+        retire_dead_registries()
+        registries = [_retired, *_registries.values()]
+    for registry in registries:
+        for key, value in registry.counters.copy().items():
+            counters[key] = counters.get(key, 0) + value
+        for key, values in registry.histograms.copy().items():
+            merged = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(list(values)):
+                merged[i] += value
+    return {'counters': counters, 'histograms': histograms}
+
+
+def dump_snapshot(snapshot):
+    return json.dumps({kind: [[name, labels, value] for (name, labels), value in metrics.items()]
+                       for kind, metrics in snapshot.items()})
+
+
+def load_snapshot(data):
+    return {kind: {(name, tuple(map(tuple, labels))): value for name, labels, value in metrics}
+            for kind, metrics in json.loads(data).items()}
+
+
+def merge_snapshots(snapshots):
+    merged = {'counters': {}, 'histograms': {}}
+    for snapshot in snapshots:
+        for key, value in snapshot['counters'].items():
+            merged['counters'][key] = merged['counters'].get(key, 0) + value
+        for key, values in snapshot['histograms'].items():
+            target = merged['histograms'].setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                target[i] += value
+    return merged
+
+
+def get_client():
+    # forum.redis reports its timings here, so it is imported late
+    from .redis import r
+    return r
+
+
+def process_key():
+    return f'{PROCESS_KEY_PREFIX}{socket.gethostname()}:{os.getpid()}'
+
+
+def push_snapshot():
+    interval = settings.METRICS_PUSH_INTERVAL
+    get_client().set(process_key(), dump_snapshot(process_snapshot()), ex=interval * 4)
+
+
+def push_loop():
+    while True:
+        time.sleep(settings.METRICS_PUSH_INTERVAL)
+        try:
+            push_snapshot()
+        except redis.RedisError:
+            pass
+
+
+def start_pusher():
+    # Once per process, forked workers included; off the request path
+    global _pusher_pid
+    if _pusher_pid != os.getpid():
+        _pusher_pid = os.getpid()
+        threading.Thread(target=push_loop, name='metrics-push', daemon=True).start()
+
+
+def collect():
+    # This process live, every other process as last pushed
+    own_key = process_key()
+    snapshots = [process_snapshot()]
+    r = get_client()
+    try:
+        keys = [key for key in r.scan_iter(f'{PROCESS_KEY_PREFIX}*') if key.decode() != own_key]
+        snapshots += [load_snapshot(data) for data in r.mget(keys) if data] if keys else []
+    except redis.RedisError:
+        pass
+    return merge_snapshots(snapshots)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def render(snapshot):
+    lines = []
+    for name, (kind, description, *buckets) in METRICS.items():
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+        bounds = [*buckets[0], '+Inf'] if buckets else []
+        if kind == 'counter':
+            for (metric, labels), value in sorted(snapshot['counters'].items()):
+                if metric == name:
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+            continue
+        for (metric, labels), values in sorted(snapshot['histograms'].items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(bounds, values[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels((*labels, ("le", bound)))} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {values[-1]}')
+            lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def record(request, response, elapsed, counter):
+    registry = get_registry()
+    route = (('route', request.resolver_match.view_name if request.resolver_match else 'unmatched'), )
+    registry.inc('forum_http_requests_total', (*route, ('method', request.method), ('status', response.status_code)))
+    registry.observe('forum_http_request_duration_seconds', route, elapsed)
+    if not response.streaming:
+        registry.observe('forum_http_response_size_bytes', route, len(response.content))
+    for name, value in (('forum_db_queries_total', counter.queries),
+                        ('forum_db_query_seconds_total', counter.query_time),
+                        ('forum_redis_round_trips_total', counter.redis),
+                        ('forum_redis_seconds_total', counter.redis_time),
+                        ('forum_cache_hits_total', counter.cache_hits),
+                        ('forum_cache_misses_total', counter.cache_misses)):
+        if value:
+            registry.inc(name, route, value)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with QueryCounter() as counter:
+            response = self.get_response(request)
+        record(request, response, time.perf_counter() - start, counter)
+        start_pusher()
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        with QueryCounter() as counter:
+            response = await self.get_response(request)
+        record(request, response, time.perf_counter() - start, counter)
+        start_pusher()
+        return response
+
+    def process_template_response(self, request, response):
+        # The outermost middleware, so the response is rendered right after
+        # this. Rendering is left to Django, which under ASGI moves it off
+        # the event loop.
+        start = time.perf_counter()
+        route = (('route', request.resolver_match.view_name), )
+
+        def rendered(response):
+            get_registry().observe('forum_template_render_seconds', route, time.perf_counter() - start)
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+def metrics(request):
+    # Without a token, only development servers answer
+    token = settings.METRICS_TOKEN
+    if not token and not settings.DEBUG:
+        raise PermissionDenied
+    authorization = request.headers.get('Authorization', '')
+    if token and not hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()):
+        raise PermissionDenied
+    return HttpResponse(render(collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,175 @@
+import logging
+import time
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+# Views declare with @query_budget how many SQL queries and Redis round
+# trips (a pipeline counts once) one request may cost. Tests check
+# responses against it with QueryBudgetMixin, and in DEBUG
+# QueryBudgetMiddleware logs (or raises, with QUERY_BUDGET_RAISE) whenever
+# a request goes over.
+
+logger = logging.getLogger(__name__)
+
+# The active counters are context-local rather than thread-local: an async
+# request shares its thread with others, and the ORM threads it hands its
+# queries to run in a copy of its context
+_counters = ContextVar('query_counters', default=())
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryBudget:
+    def __init__(self, queries=None, redis=None):
+        self.queries = queries
+        self.redis = redis
+
+    def violations(self, counter):
+        messages = []
+        if self.queries is not None and counter.queries > self.queries:
+            messages.append(f'{counter.queries} SQL queries, budget {self.queries}')
+        if self.redis is not None and counter.redis > self.redis:
+            messages.append(f'{counter.redis} Redis round trips, budget {self.redis}')
+        return messages
+
+
+def query_budget(queries=None, redis=None):
+    # Works on function views and view classes alike
+    def decorator(view):
+        view.query_budget = QueryBudget(queries, redis)
+        return view
+    return decorator
+
+
+def get_budget(view_func):
+    budget = getattr(view_func, 'query_budget', None)
+    if budget is None:
+        budget = getattr(getattr(view_func, 'view_class', None), 'query_budget', None)
+    return budget
+
+
+@receiver(connection_created)
+def install_query_counting(sender, connection, **kwargs):
+    # First, so that execute_wrapper() blocks popping their own wrapper
+    # never remove it
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, count_query)
+
+
+def count_query(execute, sql, params, many, context):
+    counters = _counters.get()
+    if not counters:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        for counter in counters:
+            counter.queries += 1
+            counter.query_time += elapsed
+            if counter.statements is not None:
+                counter.statements.append(sql)
+
+
+def record_redis(elapsed):
+    # Called by forum.redis for every round trip, a pipeline counting once
+    for counter in _counters.get():
+        counter.redis += 1
+        counter.redis_time += elapsed
+
+
+def record_cache(hit):
+    # Called by cache lookups that want to show up in hit ratios
+    for counter in _counters.get():
+        if hit:
+            counter.cache_hits += 1
+        else:
+            counter.cache_misses += 1
+
+
+class QueryCounter:
+    # Counts and times the SQL queries and Redis round trips made within
+    # the block, and counts its cache hits and misses. The SQL itself is
+    # only kept with keep_statements, for budget reports.
+    def __init__(self, keep_statements=False):
+        self.queries = 0
+        self.query_time = 0.0
+        self.redis = 0
+        self.redis_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.statements = [] if keep_statements else None
+
+    def __enter__(self):
+        for connection in connections.all():
+            install_query_counting(None, connection)
+        self.token = _counters.set((*_counters.get(), self))
+        return self
+
+    def __exit__(self, *exc_info):
+        _counters.reset(self.token)
+
+
+def check_budget(budget, counter, name):
+    messages = budget.violations(counter)
+    if not messages:
+        return
+    message = f'{name} is over its query budget: {"; ".join(messages)}'
+    if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+        raise QueryBudgetExceeded(message)
+    logger.warning(message, extra={'statements': counter.statements})
+
+
+class QueryBudgetMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DEBUG:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with QueryCounter(keep_statements=True) as counter:
+            response = self.get_response(request)
+        self.check(request, counter)
+        return response
+
+    async def __acall__(self, request):
+        with QueryCounter(keep_statements=True) as counter:
+            response = await self.get_response(request)
+        self.check(request, counter)
+        return response
+
+    def check(self, request, counter):
+        budget = getattr(request, 'query_budget', None)
+        if budget is not None:
+            check_budget(budget, counter, request.path)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = get_budget(view_func)
+
+
+class QueryBudgetMixin:
+    # For test cases: fetches a URL and fails when the view that answered
+    # it has no budget or went over it
+    def assertWithinBudget(self, url, *args, method='get', **kwargs):
+        with QueryCounter(keep_statements=True) as counter:
+            response = getattr(self.client, method)(url, *args, **kwargs)
+        budget = get_budget(response.resolver_match.func)
+        self.assertIsNotNone(budget, f'{url} declares no query budget')
+        self.assertEqual(budget.violations(counter), [], f'{url} queries:\n' + '\n'.join(counter.statements))
+        return response
@@ -0,0 +1,223 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+import weakref
+from django.conf import settings
+import redis
+from redis import asyncio as aioredis
+from .metrics import get_registry
+from .query_budget import record_redis
+
+
+# The one Redis client of the forum. Every process shares a single
+# connection pool (redis-py rebuilds it after a fork) with connect and read
+# timeouts, each command is timed into the request metrics, and a circuit
+# breaker makes callers fail fast while Redis is unreachable instead of
+# waiting for a timeout on every command. async_client() is the same for
+# async views.
+
+logger = logging.getLogger(__name__)
+
+
+class RedisUnavailable(redis.ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    # Opens after `threshold` consecutive connection errors or timeouts.
+    # While open every call fails at once; after `cooldown` seconds one call
+    # is let through and its outcome closes or reopens the circuit.
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        with self.lock:
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            # Half open: the next cooldown starts now, whatever the trial does
+            self.opened_at = time.monotonic()
+            return True
+
+    def success(self):
+        if self.failures:
+            with self.lock:
+                self.failures = 0
+                self.opened_at = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.error('Redis circuit opened after %s failures', self.failures)
+                self.opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker(settings.REDIS_BREAKER_THRESHOLD, settings.REDIS_BREAKER_COOLDOWN)
+
+
+def check_circuit(command):
+    if not breaker.allow():
+        raise RedisUnavailable(f'Redis circuit is open, {command} not sent')
+
+
+def record(command, elapsed):
+    record_redis(elapsed)
+    get_registry().observe('forum_redis_command_seconds', (('command', command), ), elapsed)
+
+
+def call(command, send, *args, **kwargs):
+    check_circuit(command)
+    start = time.perf_counter()
+    try:
+        result = send(*args, **kwargs)
+    except (redis.ConnectionError, redis.TimeoutError):
+        breaker.failure()
+        raise
+    finally:
+        record(command, time.perf_counter() - start)
+    breaker.success()
+    return result
+
+
+async def acall(command, send, *args, **kwargs):
+    check_circuit(command)
+    start = time.perf_counter()
+    try:
+        result = await send(*args, **kwargs)
+    except (redis.ConnectionError, redis.TimeoutError):
+        breaker.failure()
+        raise
+    finally:
+        record(command, time.perf_counter() - start)
+    breaker.success()
+    return result
+
+
+class Pipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error=True):
+        return call('PIPELINE', super().execute, raise_on_error)
+
+
+class Redis(redis.Redis):
+    def execute_command(self, *args, **options):
+        return call(str(args[0]).upper(), super().execute_command, *args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return Pipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class AsyncPipeline(aioredis.client.Pipeline):
+    async def execute(self, raise_on_error=True):
+        return await acall('PIPELINE', super().execute, raise_on_error)
+
+
+class AsyncRedis(aioredis.Redis):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scripts = {}
+
+    def cached_script(self, source):
+        # Registered once per client rather than on every call
+        script = self.scripts.get(source)
+        if script is None:
+            script = self.scripts[source] = self.register_script(source)
+        return script
+
+    async def execute_command(self, *args, **options):
+        return await acall(str(args[0]).upper(), super().execute_command, *args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return AsyncPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+POOL_OPTIONS = {
+    'host': settings.REDIS_HOST,
+    'port': settings.REDIS_PORT,
+    'db': settings.REDIS_DB,
+    'socket_connect_timeout': settings.REDIS_CONNECT_TIMEOUT,
+    'socket_timeout': settings.REDIS_SOCKET_TIMEOUT,
+    'max_connections': settings.REDIS_MAX_CONNECTIONS,
+    'health_check_interval': 30,
+}
+
+pool = redis.ConnectionPool(**POOL_OPTIONS)
+
+r = Redis(connection_pool=pool)
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def async_client():
+    # asyncio connections belong to the event loop that opened them, so
+    # each loop (one per ASGI worker) gets a pool of its own
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncRedis(connection_pool=aioredis.ConnectionPool(**POOL_OPTIONS))
+        client.closer = loop.create_task(disconnect_on_shutdown(client))
+    return client
+
+
+async def disconnect_on_shutdown(client):
+    # Waits for the loop to shut down. asyncio.run() and asgiref, which runs
+    # each async view in a loop of its own under WSGI, both cancel pending
+    # tasks before closing the loop, so the pool is closed while it still can be.
+    try:
+        await asyncio.Future()
+    finally:
+        await client.connection_pool.disconnect()
+
+
+def pipeline():
+    # Forum pipelines only batch round trips, they need no MULTI/EXEC
+    return r.pipeline(transaction=False)
+
+
+def skip_on_outage(func):
+    # For index writes: while Redis is unreachable the write is dropped and
+    # logged rather than failing the database change that triggered it.
+    # Rebuilding the indexes brings them back in line afterwards.
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except redis.RedisError as e:
+            logger.error('%s skipped, indexes need a rebuild: %s', func.__qualname__, e)
+    return wrapper
+
+
+def degrade(default):
+    # For reads a page can do without: while Redis is unreachable the
+    # decorated function (or coroutine function) returns default() instead
+    # of raising
+    def decorator(func):
+        def fallback(error, *args, **kwargs):
+            logger.warning('%s degraded: %s', func.__qualname__, error)
+            return default(*args, **kwargs)
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                try:
+                    return await func(*args, **kwargs)
+                except redis.RedisError as e:
+                    return fallback(e, *args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except redis.RedisError as e:
+                return fallback(e, *args, **kwargs)
+        return wrapper
+    return decorator
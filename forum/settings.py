@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 from django.utils.translation import gettext_lazy as _
 
@@ -42,7 +43,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'forum.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'forum.query_budget.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -148,6 +151,18 @@ AUTH_USER_MODEL = 'account.User'
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+SITEMAP_ROOT = BASE_DIR / 'sitemaps'
+
+# Over-budget requests (see forum/query_budget.py) raise instead of logging
+QUERY_BUDGET_RAISE = False
+
+# Request metrics served at /metrics (see forum/metrics.py)
+METRICS_ENABLED = True
+METRICS_PUSH_INTERVAL = 15
+# Scrapers must send "Authorization: Bearer <token>". Without a token,
+# /metrics is only served while DEBUG is on.
+METRICS_TOKEN = os.environ.get('FORUM_METRICS_TOKEN')
+
 # ALLOWED_HOSTS = ['myforum.com', 'localhost', '127.0.0.1']
 
 AUTHENTICATION_BACKENDS = [
@@ -185,9 +200,33 @@ CACHES = {
 }
 # '''
 
+CELERY_BEAT_SCHEDULE = {
+    'flush-article-views': {
+        'task': 'blog.tasks.flush_article_views',
+        'schedule': 60.0,
+    },
+    'generate-sitemaps': {
+        'task': 'blog.tasks.generate_sitemaps',
+        'schedule': 60.0 * 60,
+    },
+    # Corrects the drift of the related-articles scores (see blog/indexes.py)
+    'rebuild-related-index': {
+        'task': 'blog.tasks.rebuild_related_index',
+        'schedule': 60.0 * 60 * 24,
+    },
+}
+
 REDIS_HOST = 'localhost'
 REDIS_PORT = 6379
 REDIS_DB = 0
+REDIS_CONNECT_TIMEOUT = 0.5
+REDIS_SOCKET_TIMEOUT = 1.0
+REDIS_MAX_CONNECTIONS = 100
+REDIS_BREAKER_THRESHOLD = 5
+REDIS_BREAKER_COOLDOWN = 10
+
+# Async article and comment views; forum/asgi.py turns them on
+ASYNC_VIEWS = os.environ.get('FORUM_ASYNC_VIEWS') == '1'
 
 THUMBNAIL_ALIASES = {
     '': {
@@ -1,19 +1,20 @@
 from django.contrib import admin
 from django.urls import path, include
-from django.contrib.sitemaps.views import sitemap
-from blog.sitemaps import ArticleSitemap
-from account.sitemaps import UserSitemap
+from blog.views import sitemap_index, sitemap_section
+from forum.metrics import metrics
 from django.conf import settings
 from django.conf.urls.static import static
 from django.conf.urls.i18n import i18n_patterns
 
 
-sitemaps = {
-    'articles': ArticleSitemap,
-    'users': UserSitemap
-}
+urlpatterns = [
+    # Outside i18n_patterns: the sections already list every language
+    path('sitemap.xml', sitemap_index, name='sitemap'),
+    path('sitemap-<slug:section>.xml', sitemap_section, name='sitemap_section'),
+    path('metrics', metrics, name='metrics'),
+]
 
-urlpatterns = i18n_patterns(
+urlpatterns += i18n_patterns(
     path('admin/', admin.site.urls),
     path('account/', include('account.urls', namespace='account')),
     path('blog/', include('blog.urls', namespace='blog')),
@@ -21,8 +22,6 @@ urlpatterns = i18n_patterns(
     path('social-auth/', include('social_django.urls', namespace='social')),
     path('api/', include('api.urls', namespace='api')),
     path('api-auth/', include('rest_framework.urls')),
-    path('sitemap.xml', sitemap, {'sitemaps': sitemaps},
-         name='sitemap'),
 )
 
 if settings.DEBUG: